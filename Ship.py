@@ -1,285 +1,135 @@
+import io
+import json
+import struct
 import pygame
-import math
-import time
-import random
+from simulation import BarrierState, ShipState
 
+images = {}
 
-class Barrier(pygame.sprite.Sprite):
-    def __init__(self, beginpoint, size):
-        self.image = pygame.Surface(size)
-        self.rect = self.image.get_rect()
-        self.rect.x, self.rect.y = beginpoint
-        self.image.fill((255, 255, 255))
+rotations = {}
+hpBars = {}
 
+MAX_HP = 10
+HP_BAR_SIZE = (40, 15)
 
-class Bullet(pygame.sprite.Sprite):
-    def __init__(self, direction, x, y):
-        super().__init__()
-        self.image = pygame.image.load('assets/bullet.png')
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
-        self.direction = direction
-        if self.direction == 0:
-            self.direction = 360
-        self.ttl = 3
-        self.age = 0
-        self.time = time.time()
-        self.update()
+# index length, then the JSON frame index, then the packed PNG
+BUNDLE_HEADER = struct.Struct('<I')
+ROTATION_STEP = 3
+ROTATION_COUNT = 360 // ROTATION_STEP
 
-    def interpolate(self, startX, startY):
-        w = self.image.get_width()
-        h = self.image.get_height()
-        endX = self.rect.x
-        endY = self.rect.y
-        lengthX = abs(endX - startX)
-        lengthY = abs(endY - startY)
-        interpolation = []
-        iterations = max(lengthX / w, lengthY / h)
-        if startX < endX:
-            deltaX = lengthX / iterations
-        else:
-            deltaX = (lengthX / iterations) * -1
-        if startY < endY:
-            deltaY = lengthY / iterations
-        else:
-            deltaY = (lengthY / iterations) * -1
-        i = 0
-        x = startX
-        y = startY
-        while i <= iterations:
-            rect = pygame.Rect(x, y, w, h)
-            interpolation.append(rect)
-            if (deltaX < 0 and x > endX) or (deltaX > 0 and x < endX):
-                x = x + deltaX
-            if (deltaY < 0 and y > endY) or (deltaY > 0 and y < endY):
-                y = y + deltaY
-            i = i + 1
-        return interpolation
 
-    def update(self):
-        speed = 60
-        xSpeed = -math.sin(math.radians(self.direction)) * speed
-        ySpeed = -math.cos(math.radians(self.direction)) * speed
-        self.rect.move_ip(xSpeed, ySpeed)
-        newTime = time.time()
-        self.age = self.age + (newTime - self.time)
-        self.time = newTime
+def loadImage(imageName):
+    image = images.get(imageName)
+    if image is None:
+        image = pygame.image.load(imageName)
+        images[imageName] = image
+    return image
 
-    def jsonSerialize(self):
-        data = {}
-        data["time"] = self.time
-        data["x"] = self.rect.x
-        data["y"] = self.rect.y
-        data["direction"] = self.direction
-        data["age"] = self.age
-        return data
 
-    def jsonDeserialize(data):
-        bullet = Bullet(data['direction'], data['x'], data['y'])
-        bullet.time = data["time"]
-        bullet.age = data["age"]
-        return bullet
+def rotate(image, angle):
+    # rotated copies are cached per source surface and quantized angle
+    step = round(angle / ROTATION_STEP) % ROTATION_COUNT
+    key = (image, step)
+    rotated = rotations.get(key)
+    if rotated is None:
+        rotated = pygame.transform.rotate(image, step * ROTATION_STEP)
+        if pygame.display.get_surface() is not None:
+            rotated = rotated.convert_alpha()
+        rotations[key] = rotated
+    return rotated
 
 
-class Gun():
-    def __init__(self):
-        self.lastTimeFired = 0
-        self.interval = 0.2
-        self.bullets = []
+def precomputeRotations(imageNames):
+    for imageName in imageNames:
+        image = loadImage(imageName)
+        for step in range(ROTATION_COUNT):
+            rotate(image, step * ROTATION_STEP)
 
-    def shoot(self, direction, x, y):
-        if time.time() - self.lastTimeFired > self.interval:
-            bullet = Bullet(direction, x, y)
-            self.bullets.append(bullet)
-            self.lastTimeFired = time.time()
 
-    def expireOldBullets(self):
-        self.bullets = list(filter(lambda b: b.age < b.ttl, self.bullets))
+def loadAtlas(data):
+    indexSize, = BUNDLE_HEADER.unpack_from(data, 0)
+    indexEnd = BUNDLE_HEADER.size + indexSize
+    index = json.loads(bytes(data[BUNDLE_HEADER.size:indexEnd]).decode())
+    atlas = pygame.image.load(io.BytesIO(data[indexEnd:]), 'atlas.png')
+    # frames share the atlas pixels, registered under their file names
+    for name, frame in index['frames'].items():
+        images[name] = atlas.subsurface(pygame.Rect(frame))
+    return atlas
 
-    def jsonSerialize(self):
-        bullets = list(
-            map(lambda bullet: bullet.jsonSerialize(), self.bullets))
-        data = {'bullets': bullets, 'lastTimeFired': self.lastTimeFired}
-        return data
 
-    def jsonDeserialize(data):
-        gun = Gun()
-        bulletDataList = data['bullets']
-        gun.lastTimeFired = data['lastTimeFired']
-        gun.bullets = list(
-            map(lambda data: Bullet.jsonDeserialize(data), bulletDataList))
-        return gun
+class Barrier(BarrierState):
+    def __init__(self, beginpoint, size):
+        super().__init__(beginpoint, size)
+        self.image = pygame.Surface(size)
+        self.rect = self.image.get_rect()
+        self.rect.x, self.rect.y = beginpoint
+        self.image.fill((255, 255, 255))
 
 
-class HPBar(pygame.sprite.Sprite):
-    def __init__(self, hp, x, y):
-        super().__init__()
-        h = 15
-        w = 40
-        self.image = pygame.Surface((40, h))
-        # self.image = pygame.image.load('bullet.png')
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
-        greenX = (hp / 10) * w
-        self.green = pygame.Surface((greenX, h))
-        self.green.fill((0, 255, 0))
-        redX = ((10-hp)/10) * w
-        self.red = pygame.Surface((redX, h))
-        self.red.fill((255, 0, 0))
-        self.image.blit(self.red, (greenX, 0))
-        self.image.blit(self.green, (0, 0))
+def hpBarImage(hp):
+    hp = max(0, min(MAX_HP, int(hp)))
+    image = hpBars.get(hp)
+    if image is None:
+        h = HP_BAR_SIZE[1]
+        w = HP_BAR_SIZE[0]
+        image = pygame.Surface((w, h))
+        greenX = (hp / MAX_HP) * w
+        image.fill((255, 0, 0))
+        image.fill((0, 255, 0), pygame.Rect(0, 0, greenX, h))
+        hpBars[hp] = image
+    return image
 
 
-class Ship(pygame.sprite.Sprite):
-    respawnTimer = 5
+class HPBar():
+    def __init__(self, hp, x, y):
+        self.rect = pygame.Rect((x, y), HP_BAR_SIZE)
+        self.image = hpBarImage(hp)
 
-    def __init__(self, x, y, hitpoints=10, imageName='assets/ship.png'):
-        super().__init__()
-        self.image = pygame.image.load(imageName)
-        self.rect = self.image.get_rect()
+    def place(self, hp, x, y):
         self.rect.x = x
         self.rect.y = y
-        self.velocity = 0
-        self.direction = 360
-        self.colliding = False
-        self.hitpoints = hitpoints
-        self.dead = False
-        self.gun = Gun()
-        self.deadStamp = 0
-        self.hpbar = HPBar(self.hitpoints, self.rect.x, self.rect.y - 30)
-
-    def setImage(self, imageName):
-        self.image = pygame.image.load(imageName)
-
-    def update(self, ships):
-        self.handleInterShipCollision(ships)
-        self.handleDeath()
-        xSpeed = -math.sin(math.radians(self.direction)) * self.velocity
-        ySpeed = -math.cos(math.radians(self.direction)) * self.velocity
-        self.rect.move_ip(round(xSpeed, 0), round(ySpeed, 0))
-        self.hpbar = HPBar(self.hitpoints, self.rect.x, self.rect.y - 30)
+        self.image = hpBarImage(hp)
 
-    def takeDamage(self, damage):
-        if self.hitpoints > 0:
-            self.hitpoints = self.hitpoints - damage
-            if self.hitpoints < 0:
-                self.hitpoints = 0
 
-    def handleDeath(self):
-        if self.hitpoints <= 0:
-            if self.deadStamp == 0:
-                self.deadStamp = time.time()
-            self.dead = True
-            self.image = pygame.image.load('assets/explosion.png')
+class Ship(ShipState):
+    def __init__(self, x, y, hitpoints=10, imageName='assets/ship.png'):
+        super().__init__(x, y, hitpoints)
+        self.imageName = imageName
+        self.hpbar = HPBar(self.hitpoints, self.x, self.y - 30)
 
-    def spawn(self):
-        if self.dead and time.time() - self.deadStamp > Ship.respawnTimer:
-            self.rect.x = random.randint(0, 400)
-            self.rect.y = random.randint(0, 400)
-            self.dead = False
-            self.deadStamp = 0
-            self.velocity = 0
-            self.hitpoints = 10
-            self.image = pygame.image.load('assets/ship.png')
-            self.colliding = False
-            self.hpbar = HPBar(self.hitpoints, self.rect.x, self.rect.y - 30)
+    @property
+    def image(self):
+        if self.dead:
+            return loadImage('assets/explosion.png')
+        return loadImage(self.imageName)
 
-    def handleInterShipCollision(self, ships):
-        collision = False
-        for ship in ships:
-            if self.rect.colliderect(ship.rect):
-                collision = True
-                if not self.colliding and not ship.colliding:
-                    self.colliding = True
-                    ship.colliding = True
-                    self.takeDamage(1)
-                    ship.takeDamage(1)
-                    oldVelocity = self.velocity
-                    oldDir = self.direction
-                    self.direction = ship.direction
-                    self.velocity = ship.velocity
-                    ship.direction = oldDir
-                    ship.velocity = oldVelocity
-                    xSpeed = - \
-                        math.sin(math.radians(self.direction)) * self.velocity
-                    ySpeed = - \
-                        math.cos(math.radians(self.direction)) * self.velocity
-                    self.rect.move_ip(round(xSpeed, 0),
-                                      round(ySpeed, 0))
-                    xSpeed = - \
-                        math.sin(math.radians(ship.direction)) * ship.velocity
-                    ySpeed = - \
-                        math.cos(math.radians(ship.direction)) * ship.velocity
-                    ship.rect.move_ip(round(xSpeed, 0), round(ySpeed, 0))
-        return collision
+    @property
+    def rect(self):
+        return pygame.Rect(self.x, self.y, self.w, self.h)
 
-    def handleMovementInput(self, pressed, deltaTime, ships):
-        maxVelocity = 15
-        if self.dead:
-            return
-        if pressed[pygame.K_w]:
-            self.velocity = 5 * deltaTime + self.velocity
-            if self.velocity > maxVelocity:
-                self.velocity = maxVelocity
-        elif pressed[pygame.K_s]:
-            self.velocity = self.velocity - 20 * deltaTime
-            if self.velocity < 0:
-                self.velocity = 0
-        if pressed[pygame.K_a]:
-            self.direction = self.direction + 180 * deltaTime
-        elif pressed[pygame.K_d]:
-            self.direction = self.direction - 180 * deltaTime
-        if pressed[pygame.K_SPACE]:
-            x, y = self.getCenter()
-            x = x - math.sin(math.radians(self.direction)) * self.velocity
-            y = y - math.cos(math.radians(self.direction)) * self.velocity
-            self.gun.shoot(self.getDirection(), x, y)
-        self.update(ships)
+    def setImage(self, imageName):
+        self.imageName = imageName
 
-    def isSame(self, ship):
-        return self.rect.x == ship.rect.x and self.rect.y == ship.rect.y
+    def placeHpBar(self):
+        self.hpbar.place(self.hitpoints, self.x, self.y - 30)
 
-    def jsonSerialize(self):
-        data = {"x": self.rect.x,
-                "y": self.rect.y,
-                "h": self.rect.h,
-                "w": self.rect.w,
-                "velocity": self.velocity,
-                "hitpoints": self.hitpoints,
-                "colliding": self.colliding,
-                "dead": self.dead,
-                "deadStamp": self.deadStamp,
-                "gun": self.gun.jsonSerialize(),
-                "direction": self.direction
-                }
-        return data
+    def update(self, ships):
+        super().update(ships)
+        self.placeHpBar()
 
-    def jsonDeserialize(ship):
-        x = ship["x"]
-        y = ship["y"]
-        hitpoints = ship['hitpoints']
-        newShip = Ship(x, y, hitpoints=hitpoints)
-        velocity = ship['velocity']
-        newShip.rect.x = x
-        newShip.rect.y = y
-        newShip.velocity = velocity
-        newShip.colliding = ship['colliding']
-        newShip.dead = ship['dead']
-        newShip.deadStamp = ship['deadStamp']
-        newShip.gun = Gun.jsonDeserialize(ship['gun'])
-        newShip.direction = ship['direction']
-        newShip.handleDeath()
-        return newShip
+    def spawn(self):
+        super().spawn()
+        self.placeHpBar()
 
-    def getDirection(self):
-        return self.direction
+    def copyState(self, ship):
+        super().copyState(ship)
+        self.placeHpBar()
 
-    def deepCopy(self):
-        return Ship.jsonDeserialize(self.jsonSerialize())
+    def readJson(self, data):
+        super().readJson(data)
+        self.placeHpBar()
 
-    def getCenter(self):
-        x = self.rect.x + self.rect.width/2
-        y = self.rect.y + self.rect.height/2
-        return x, y
+    def jsonDeserialize(data):
+        ship = Ship(data["x"], data["y"], hitpoints=data['hitpoints'])
+        ship.readJson(data)
+        return ship
@@ -0,0 +1,62 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from broadphase import SpatialHash  # noqa: E402
+from gameServer import createBarriers  # noqa: E402
+from gameServer import formTimeLineData, simulateMovements  # noqa: E402
+from simulation import handleBullets, handleBarriers  # noqa: E402
+from worlds import createWorld  # noqa: E402
+
+SHIP_COUNTS = (16, 32, 64, 128, 256)
+BULLETS_PER_SHIP = 10
+INPUTS_PER_SHIP = 3
+REPEATS = 20
+
+
+def copyWorld(ships, bullets):
+    return {key: ship.copy() for key, ship in ships.items()}, bullets.copy()
+
+
+def timeStage(ships, bullets, timeline, barriers, useGrid):
+    totals = {'movements': 0.0, 'bullets': 0.0, 'barriers': 0.0}
+    grid = SpatialHash() if useGrid else None
+    for i in range(REPEATS):
+        tickShips, tickBullets = copyWorld(ships, bullets)
+        start = time.perf_counter()
+        if grid is not None:
+            grid.rebuild(tickShips)
+        simulateMovements(tickShips, formTimeLineData(timeline), grid)
+        moved = time.perf_counter()
+        handleBullets(tickShips, tickBullets, grid)
+        shot = time.perf_counter()
+        handleBarriers(tickShips, barriers, grid)
+        end = time.perf_counter()
+        totals['movements'] += moved - start
+        totals['bullets'] += shot - moved
+        totals['barriers'] += end - shot
+    return {key: value / REPEATS * 1000 for key, value in totals.items()}
+
+
+def main():
+    barriers = createBarriers()
+    print('{:>6} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'ships', 'move', 'move+grid', 'bullets', 'bul+grid', 'barrier',
+        'bar+grid'))
+    for shipCount in SHIP_COUNTS:
+        ships, bullets, timeline = createWorld(
+            shipCount, shipCount * BULLETS_PER_SHIP, INPUTS_PER_SHIP)
+        brute = timeStage(ships, bullets, timeline, barriers, False)
+        hashed = timeStage(ships, bullets, timeline, barriers, True)
+        print('{:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} '
+              '{:>10.3f}'.format(
+                  shipCount, brute['movements'], hashed['movements'],
+                  brute['bullets'], hashed['bullets'], brute['barriers'],
+                  hashed['barriers']))
+    print('times are milliseconds per tick')
+
+
+if __name__ == '__main__':
+    main()
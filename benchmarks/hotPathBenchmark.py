@@ -0,0 +1,386 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from broadphase import SpatialHash, GRID_MIN_SHIPS  # noqa: E402
+from gameServer import createBarriers, MAX_REWIND  # noqa: E402
+from gameServer import formTimeLineData, simulateMovements  # noqa: E402
+from interpolation import InterpolationBuffer  # noqa: E402
+from simulation import ShipState, PositionHistory, HISTORY_TICKS  # noqa: E402
+from simulation import handleBullets, handleBarriers  # noqa: E402
+from simulation import freezeTime  # noqa: E402
+from snapshotCodec import SnapshotEncoder, SnapshotDecoder  # noqa: E402
+from worlds import createWorld  # noqa: E402
+
+# ships, bullets, buffered inputs per ship; rooms hold 16 players, the
+# largest world is a stress case
+WORLDS = ((4, 40, 3), (16, 160, 3), (64, 640, 3))
+REPEATS = 20
+# the server's default tick rate, spacing of the recorded positions
+TICK_PERIOD = 0.05
+BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+# a stage regresses when its best run is this much slower or it allocates
+# this much more than its baseline; tiny absolute changes are timer noise
+THRESHOLD = 0.25
+NOISE_MS = 0.1
+
+
+def worldName(world):
+    return '{}x{}x{}'.format(*world)
+
+
+def parseWorld(text):
+    try:
+        ships, bullets, inputs = (int(value) for value in text.split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'worlds are SHIPSxBULLETSxINPUTS, e.g. 64x640x3')
+    return ships, bullets, inputs
+
+
+def copyWorld(world):
+    ships, bullets, inputs = world
+    random.seed(0)
+    bullets = bullets.copy()
+    # bullets live for seconds of wall time, keep them young every repeat
+    bullets.time[:bullets.count] = time.time()
+    return ({key: ship.copy() for key, ship in ships.items()}, bullets,
+            {key: list(items) for key, items in inputs.items()})
+
+
+def movedShips(ships):
+    moved = {}
+    for key, ship in ships.items():
+        ship = ship.copy()
+        ship.x = ship.x + key % 3
+        ship.direction = ship.direction + 1
+        moved[key] = ship
+    return moved
+
+
+def encodeTicks(ships, bullets):
+    encoder = SnapshotEncoder()
+    encoder.capture(1, 1.0, ships, bullets)
+    for key, ship in ships.items():
+        encoder.encodeFor(key, ship, 0)
+    bullets = bullets.copy()
+    bullets.x[:bullets.count] += 5
+    return encoder, movedShips(ships), bullets
+
+
+def serverGrid(ships):
+    # Room.advance only uses the broadphase in rooms this big
+    if len(ships) < GRID_MIN_SHIPS:
+        return None
+    grid = SpatialHash()
+    grid.rebuild(ships)
+    return grid
+
+
+def setupCopy(world):
+    return copyWorld(world)
+
+
+def runCopy(state):
+    ships, bullets, inputs = state
+    for ship in ships.values():
+        ship.copy()
+    bullets.copy()
+
+
+def setupSerialize(world):
+    return copyWorld(world)
+
+
+def runSerialize(state):
+    ships, bullets, inputs = state
+    for ship in ships.values():
+        ship.jsonSerialize()
+
+
+def setupDeserialize(world):
+    ships, bullets, inputs = copyWorld(world)
+    return [ship.jsonSerialize() for ship in ships.values()]
+
+
+def runDeserialize(state):
+    for data in state:
+        ShipState.jsonDeserialize(data)
+
+
+def setupTimeline(world):
+    return copyWorld(world)[2]
+
+
+def runTimeline(state):
+    for item in formTimeLineData(state):
+        pass
+
+
+def setupMovements(world):
+    ships, bullets, inputs = copyWorld(world)
+    grid = serverGrid(ships)
+    return ships, formTimeLineData(inputs), grid
+
+
+def runMovements(state):
+    simulateMovements(*state)
+
+
+def setupBullets(world):
+    ships, bullets, inputs = copyWorld(world)
+    grid = serverGrid(ships)
+    return ships, bullets, grid
+
+
+def runBullets(state):
+    handleBullets(*state)
+
+
+def setupLaggedBullets(world):
+    # every shooter is up to MAX_REWIND behind, so each bullet is tested
+    # against ship positions taken from a full position history
+    ships, bullets, inputs = copyWorld(world)
+    rng = random.Random(0)
+    when = time.time()
+    history = PositionHistory(HISTORY_TICKS, max(len(ships), 1))
+    for tick in range(HISTORY_TICKS - 1, -1, -1):
+        past = {}
+        for key, ship in ships.items():
+            ship = ship.copy()
+            ship.x = ship.x - tick * (key % 5 - 2) * 3
+            ship.y = ship.y - tick * (key % 3 - 1) * 3
+            past[key] = ship
+        history.record(when - tick * TICK_PERIOD, past)
+    lags = {key: rng.uniform(0, MAX_REWIND) for key in ships}
+    n = bullets.count
+    bullets.time[:n] = when
+    bullets.lag[:n] = [lags.get(owner, 0) for owner in
+                       bullets.owner[:n].tolist()]
+    grid = serverGrid(ships)
+    return ships, bullets, grid, history, lags, when
+
+
+def runLaggedBullets(state):
+    ships, bullets, grid, history, lags, when = state
+    freezeTime(when)
+    handleBullets(ships, bullets, grid, history, lags)
+    freezeTime(None)
+
+
+def setupBarriers(world):
+    ships, bullets, inputs = copyWorld(world)
+    grid = serverGrid(ships)
+    return ships, createBarriers(), grid
+
+
+def runBarriers(state):
+    handleBarriers(*state)
+
+
+def setupEncode(world):
+    ships, bullets, inputs = copyWorld(world)
+    return encodeTicks(ships, bullets)
+
+
+def runEncode(state):
+    encoder, ships, bullets = state
+    encoder.capture(2, 2.0, ships, bullets)
+    for key, ship in ships.items():
+        encoder.encodeFor(key, ship, 1)
+
+
+def setupDecode(world):
+    ships, bullets, inputs = copyWorld(world)
+    if len(ships) == 0:
+        return None, b''
+    decoder = SnapshotDecoder()
+    encoder, ships, bullets = encodeTicks(ships, bullets)
+    decoder.decode(bytes(encoder.encodeFor(0, ships[0], 0)))
+    encoder.capture(2, 2.0, ships, bullets)
+    return decoder, bytes(encoder.encodeFor(0, ships[0], 1))
+
+
+def runDecode(state):
+    decoder, data = state
+    if decoder is not None:
+        decoder.decode(data)
+
+
+def setupInterpolation(world):
+    ships, bullets, inputs = copyWorld(world)
+    encoder, moved, movedBullets = encodeTicks(ships, bullets)
+    shipData = {key: ship.jsonSerialize() for key, ship in ships.items()}
+    movedData = {key: ship.jsonSerialize() for key, ship in moved.items()}
+    buffer = InterpolationBuffer(delay=0)
+    buffer.push(1.0, shipData, list(bullets.records()), 1.0)
+    buffer.push(1.05, movedData, list(movedBullets.records()), 1.05)
+    return buffer
+
+
+def runInterpolation(state):
+    state.sample(1.025)
+
+
+# the stages every server tick or client frame runs, in tick order
+STAGES = (
+    ('copy', setupCopy, runCopy),
+    ('serialize', setupSerialize, runSerialize),
+    ('deserialize', setupDeserialize, runDeserialize),
+    ('timeline', setupTimeline, runTimeline),
+    ('movements', setupMovements, runMovements),
+    ('bullets', setupBullets, runBullets),
+    ('lagged', setupLaggedBullets, runLaggedBullets),
+    ('barriers', setupBarriers, runBarriers),
+    ('encode', setupEncode, runEncode),
+    ('decode', setupDecode, runDecode),
+    ('interpolation', setupInterpolation, runInterpolation),
+)
+
+
+def measureStage(world, setup, run, repeats):
+    durations = []
+    for i in range(repeats):
+        state = setup(world)
+        start = time.perf_counter()
+        run(state)
+        durations.append(time.perf_counter() - start)
+    # allocations are counted in a second pass, tracing slows the timings
+    allocated = []
+    retained = []
+    tracemalloc.start()
+    try:
+        for i in range(repeats):
+            state = setup(world)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            run(state)
+            current, peak = tracemalloc.get_traced_memory()
+            allocated.append(peak - before)
+            retained.append(current - before)
+    finally:
+        tracemalloc.stop()
+    durations.sort()
+    return {'ms': round(float(np.median(durations)) * 1000, 4),
+            'minMs': round(durations[0] * 1000, 4),
+            'p90ms': round(float(np.percentile(durations, 90)) * 1000, 4),
+            'peakKiB': round(float(np.median(allocated)) / 1024, 2),
+            'retainedKiB': round(float(np.median(retained)) / 1024, 2)}
+
+
+def runSuite(worlds, stages, repeats, seed):
+    results = {}
+    for world in worlds:
+        state = createWorld(*world, seed=seed)
+        results[worldName(world)] = {}
+        for name, setup, run in stages:
+            results[worldName(world)][name] = measureStage(
+                state, setup, run, repeats)
+    return results
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    regressions = []
+    for world, stages in results.items():
+        for name, result in stages.items():
+            base = baseline.get(world, {}).get(name)
+            if base is None:
+                continue
+            slower = result['minMs'] - base['minMs']
+            if slower > NOISE_MS and result['minMs'] > base['minMs'] * (
+                    1 + threshold):
+                regressions.append((world, name, 'minMs', base['minMs'],
+                                    result['minMs']))
+            if result['peakKiB'] > max(base['peakKiB'], 1) * (1 + threshold):
+                regressions.append((world, name, 'peakKiB',
+                                    base['peakKiB'], result['peakKiB']))
+    return regressions
+
+
+def report(results, baseline):
+    print('{:>14} {:>13} {:>10} {:>10} {:>10} {:>10} {:>9}'.format(
+        'world', 'stage', 'ms', 'p90 ms', 'peak KiB', 'kept KiB',
+        'vs base'))
+    for world, stages in results.items():
+        for name, result in stages.items():
+            base = baseline.get(world, {}).get(name)
+            change = ''
+            if base is not None and base['ms'] > 0:
+                change = '{:+.0f} %'.format(
+                    (result['ms'] / base['ms'] - 1) * 100)
+            print('{:>14} {:>13} {:>10.3f} {:>10.3f} {:>10.2f} {:>10.2f} '
+                  '{:>9}'.format(world, name, result['ms'], result['p90ms'],
+                                 result['peakKiB'], result['retainedKiB'],
+                                 change))
+    print('worlds are ships x bullets x inputs per ship, times are per tick')
+
+
+def loadBaseline(path):
+    try:
+        with open(path) as baselineFile:
+            return json.load(baselineFile)['results']
+    except FileNotFoundError:
+        return {}
+
+
+def saveBaseline(path, results, repeats, seed):
+    data = {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'repeats': repeats,
+            'seed': seed,
+            'results': results}
+    with open(path, 'w') as baselineFile:
+        json.dump(data, baselineFile, indent=2, sort_keys=True)
+        baselineFile.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='time the per tick hot paths on synthetic worlds and '
+        'compare them with a baseline saved on this machine by --save')
+    parser.add_argument('--world', type=parseWorld, action='append',
+                        help='SHIPSxBULLETSxINPUTS, may be repeated')
+    parser.add_argument('--stage', choices=[stage[0] for stage in STAGES],
+                        action='append', help='only run these stages')
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='fraction a stage may grow before it is '
+                        'flagged')
+    args = parser.parse_args()
+    worlds = args.world or WORLDS
+    stages = [stage for stage in STAGES
+              if args.stage is None or stage[0] in args.stage]
+    results = runSuite(worlds, stages, args.repeats, args.seed)
+    baseline = loadBaseline(args.baseline)
+    report(results, baseline)
+    if args.save:
+        saveBaseline(args.baseline, results, args.repeats, args.seed)
+        print('saved baseline to {}'.format(args.baseline))
+        return 0
+    if not baseline:
+        print('no baseline at {}, run with --save first to compare '
+              'against one'.format(args.baseline))
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    for world, name, metric, old, new in regressions:
+        print('REGRESSION {} {} {}: {} -> {}'.format(world, name, metric,
+                                                    old, new))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gameClient import createMessage  # noqa: E402
+from inputCodec import KEY_W, KEY_A, KEY_S, KEY_D, KEY_SPACE  # noqa: E402
+from snapshotCodec import isSnapshot, SnapshotDecoder  # noqa: E402
+
+HOST = '127.0.0.1'
+PORT = 9999
+INPUT_RATE = 60
+SEND_INTERVAL = 0.05
+HANDSHAKE_TIMEOUT = 5
+
+
+def idlePattern(rng, elapsed):
+    return 0
+
+
+def circlePattern(rng, elapsed):
+    return KEY_W | KEY_A
+
+
+def randomPattern(rng, elapsed):
+    return rng.choice((0, KEY_W, KEY_W | KEY_A, KEY_W | KEY_D, KEY_S,
+                       KEY_W | KEY_SPACE, KEY_A | KEY_SPACE))
+
+
+def firePattern(rng, elapsed):
+    turn = KEY_A if int(elapsed) % 2 == 0 else KEY_D
+    return KEY_W | KEY_SPACE | turn
+
+
+PATTERNS = {
+    'idle': idlePattern,
+    'circle': circlePattern,
+    'random': randomPattern,
+    'fire': firePattern,
+}
+
+
+class BotProtocol:
+    def __init__(self, message, connected):
+        self.message = message
+        self.connected = connected
+        self.snapshots = SnapshotDecoder()
+        self.clientId = None
+        self.kicked = False
+        self.lastTick = 0
+        self.resetStats()
+
+    def resetStats(self):
+        self.received = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.firstTick = None
+        self.firstArrival = None
+        self.lastArrival = None
+        self.latencies = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.send(self.message.encode())
+
+    def send(self, data):
+        self.bytesOut = self.bytesOut + len(data)
+        self.transport.sendto(data)
+
+    def datagram_received(self, data, addr):
+        now = time.time()
+        self.bytesIn = self.bytesIn + len(data)
+        if not isSnapshot(data):
+            if json.loads(data.decode()).get('kick', False):
+                self.kicked = True
+                if not self.connected.done():
+                    self.connected.set_result(False)
+            return
+        items = self.snapshots.decode(data)
+        if items is None:
+            return
+        if items['handshake'] == 1:
+            self.clientId = items['clientId']
+            if not self.connected.done():
+                self.connected.set_result(True)
+            return
+        # server and bots share a clock on localhost
+        self.latencies.append(now - items['timeStamp'])
+        if self.firstTick is None:
+            self.firstTick = items['tick']
+            self.firstArrival = now
+        self.lastTick = items['tick']
+        self.lastArrival = now
+        self.received = self.received + 1
+
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        pass
+
+
+class Bot():
+    def __init__(self, protocol, transport, pattern, rng):
+        self.protocol = protocol
+        self.transport = transport
+        self.pattern = pattern
+        self.rng = rng
+        self.sequence = 1
+        self.inputBuffer = []
+        self.mask = pattern(rng, 0)
+
+    def input(self, now, delta, elapsed):
+        if self.rng.random() < delta * 2:
+            self.mask = self.pattern(self.rng, elapsed)
+        self.inputBuffer.append({"seq": self.sequence, "mask": self.mask,
+                                 "delta": delta, "timestamp": now})
+        self.sequence = self.sequence + 1
+
+    def flush(self, now):
+        protocol = self.protocol
+        if protocol.clientId is None or protocol.kicked:
+            self.inputBuffer = []
+            return
+        message = createMessage(self.inputBuffer, protocol.clientId, now,
+                                protocol.snapshots.lastTick)
+        protocol.send(message)
+        self.inputBuffer = []
+
+
+async def connectBot(loop, host, port, room, pattern, rng):
+    connected = loop.create_future()
+    message = json.dumps({'handshake': 1, 'room': room})
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: BotProtocol(message, connected),
+        remote_addr=(host, port))
+    try:
+        accepted = await asyncio.wait_for(connected, HANDSHAKE_TIMEOUT)
+    except asyncio.TimeoutError:
+        accepted = False
+    if not accepted:
+        transport.close()
+        return None
+    return Bot(protocol, transport, pattern, rng)
+
+
+async def drive(bots, duration, inputRate=INPUT_RATE):
+    # one loop feeds every bot so hundreds of them stay cheap
+    for bot in bots:
+        bot.protocol.resetStats()
+    start = time.time()
+    lastInput = start
+    lastSent = start
+    while True:
+        await asyncio.sleep(1 / inputRate)
+        now = time.time()
+        if now - start >= duration:
+            break
+        delta = round(now - lastInput, 4)
+        lastInput = now
+        for bot in bots:
+            bot.input(now, delta, now - start)
+        if now - lastSent >= SEND_INTERVAL:
+            lastSent = now
+            for bot in bots:
+                bot.flush(now)
+
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def report(bots, attempted, duration):
+    latencies = []
+    received = 0
+    expected = 0
+    tickRates = []
+    bytesIn = 0
+    bytesOut = 0
+    for bot in bots:
+        protocol = bot.protocol
+        latencies.extend(protocol.latencies)
+        bytesIn = bytesIn + protocol.bytesIn
+        bytesOut = bytesOut + protocol.bytesOut
+        if protocol.firstTick is None:
+            continue
+        received = received + protocol.received
+        expected = expected + protocol.lastTick - protocol.firstTick + 1
+        span = protocol.lastArrival - protocol.firstArrival
+        if span > 0:
+            tickRates.append((protocol.lastTick - protocol.firstTick) / span)
+    clients = max(len(bots), 1)
+    loss = 1 - received / expected if expected > 0 else 0
+    tickRate = sum(tickRates) / len(tickRates) if tickRates else 0
+    print('clients connected   {} of {}'.format(len(bots), attempted))
+    print('server tick rate    {:.2f} Hz'.format(tickRate))
+    print('snapshot latency    p50 {:.2f} ms, p99 {:.2f} ms'.format(
+        percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.99) * 1000))
+    print('snapshot loss       {:.2f} %'.format(loss * 100))
+    print('bytes per client    {:.0f} B/s down, {:.0f} B/s up'.format(
+        bytesIn / clients / duration, bytesOut / clients / duration))
+
+
+async def main(clients, duration, host, port, pattern, room, seed):
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    bots = []
+    for i in range(clients):
+        bot = await connectBot(loop, host, port, room, PATTERNS[pattern],
+                               random.Random(rng.random()))
+        if bot is not None:
+            bots.append(bot)
+    try:
+        await drive(bots, duration)
+    finally:
+        for bot in bots:
+            bot.transport.close()
+    report(bots, clients, duration)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='headless bots against a local game server; start it '
+        'with enough --rooms for the bot count, 16 players fit in a room')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds of play after every bot joined')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--pattern', choices=sorted(PATTERNS),
+                        default='random')
+    parser.add_argument('--room', type=int, default=None,
+                        help='join this room instead of letting the server '
+                        'place the bots')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main(args.clients, args.duration, args.host, args.port,
+                     args.pattern, args.room, args.seed))
@@ -0,0 +1,88 @@
+import argparse
+import cProfile
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gameServer import Room  # noqa: E402
+from inputLog import readLog, stateChecksum  # noqa: E402
+from tickMetrics import TickMetrics, PHASES  # noqa: E402
+
+
+class NullTransport():
+    def sendto(self, data, addr=None):
+        pass
+
+
+def replay(path, metrics=None):
+    # feeds every recorded tick through the same Room.advance the server
+    # ran, back to back and without sockets; snapshots are still encoded
+    transport = NullTransport()
+    settings = None
+    rooms = {}
+    ticks = 0
+    mismatches = []
+    for kind, record in readLog(path):
+        if kind == 'session':
+            settings = record
+            rooms = {}
+            continue
+        room = rooms.get(record['room'])
+        if room is None:
+            room = Room(record['room'], settings['serverName'],
+                        settings['interestRadius'], settings['maxRewind'],
+                        metrics)
+            rooms[record['room']] = room
+        if kind == 'join':
+            room.join(record['clientId'], None, (record['x'], record['y']))
+            continue
+        room.acks.update(record['acks'])
+        room.tick = record['tick'] - 1
+        room.advance(transport, record['timeStamp'], record['inputs'],
+                     record['lags'], record['expired'], record['seed'])
+        ticks = ticks + 1
+        if stateChecksum(room.item, room.bullets) != record['checksum']:
+            mismatches.append((record['room'], record['tick']))
+    return ticks, mismatches, settings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='replay a log recorded with gameServer.py --record as '
+        'fast as possible')
+    parser.add_argument('log')
+    parser.add_argument('--profile', metavar='PATH', default=None,
+                        help='write cProfile stats of the replay here')
+    args = parser.parse_args()
+    metrics = TickMetrics(1)
+    profile = None
+    if args.profile:
+        profile = cProfile.Profile()
+        profile.enable()
+    start = time.perf_counter()
+    ticks, mismatches, settings = replay(args.log, metrics)
+    elapsed = time.perf_counter() - start
+    if profile is not None:
+        profile.disable()
+        profile.dump_stats(args.profile)
+    if settings is None:
+        print('{} holds no session'.format(args.log))
+        return 1
+    print('replayed {} room ticks in {:.3f} s, {:.0f} ticks/s'.format(
+        ticks, elapsed, ticks / elapsed if elapsed > 0 else 0))
+    for phase in PHASES:
+        print('{:>10} {:>9.3f} ms per tick'.format(
+            phase, metrics.phases[phase] / max(ticks, 1) * 1000))
+    if mismatches:
+        room, tick = mismatches[0]
+        print('{} ticks diverged from the recording, first room {} tick '
+              '{}'.format(len(mismatches), room, tick))
+        return 1
+    print('every tick matched the recorded state')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import random
+import time
+
+from gameServer import WORLD_SIZE
+from simulation import ShipState, BulletPool
+from inputCodec import KEY_W, KEY_A, KEY_D, KEY_SPACE
+
+ARENA = WORLD_SIZE
+
+
+def createWorld(shipCount, bulletCount, inputCount, seed=0):
+    # ships at random spots and speeds, bullets spread evenly over their
+    # owners and a few sorted inputs buffered for every ship
+    rng = random.Random(seed)
+    ships = {}
+    for key in range(shipCount):
+        ship = ShipState(rng.randint(0, ARENA[0] - 41),
+                         rng.randint(0, ARENA[1] - 32))
+        ship.velocity = rng.uniform(0, 15)
+        ship.direction = rng.uniform(0, 360)
+        ships[key] = ship
+    bullets = BulletPool(max(bulletCount, 1))
+    now = time.time()
+    for i in range(bulletCount):
+        bullets.add(i % max(shipCount, 1), i, rng.randint(0, ARENA[0]),
+                    rng.randint(0, ARENA[1]), rng.uniform(0, 360), 0, now)
+    inputs = {}
+    for key in ships:
+        inputs[key] = []
+        for i in range(inputCount):
+            inputs[key].append({'seq': i, 'delta': 0.016,
+                                'timestamp': rng.random(),
+                                'mask': rng.choice((KEY_W, KEY_A, KEY_D,
+                                                    KEY_W | KEY_SPACE))})
+        inputs[key].sort(key=lambda value: value['timestamp'])
+    return ships, bullets, inputs
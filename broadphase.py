@@ -0,0 +1,132 @@
+import numpy as np
+
+CELL_SIZE = 64
+CELL_OFFSET = 1 << 20
+CELL_SPAN = 1 << 21
+# below this many ships the all-pairs loops beat the hash, see
+# benchmarks/collisionBenchmark.py
+GRID_MIN_SHIPS = 32
+
+
+def cellId(cx, cy):
+    return (cx + CELL_OFFSET) * CELL_SPAN + (cy + CELL_OFFSET)
+
+
+def expand(counts):
+    # index of the owning row and position within it for every expanded item
+    total = int(counts.sum())
+    rows = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    return rows, np.arange(total) - np.repeat(starts, counts)
+
+
+class SpatialHash():
+    def __init__(self, cellSize=CELL_SIZE):
+        self.cellSize = cellSize
+        self.cells = {}
+        self.ranges = {}
+        self.order = {}
+        self.counter = 0
+        self.arrays = None
+
+    def cellRange(self, x, y, w, h):
+        size = self.cellSize
+        return (x // size, y // size,
+                (x + w - 1) // size, (y + h - 1) // size)
+
+    def move(self, key, ship):
+        cellRange = self.cellRange(ship.x, ship.y, ship.w, ship.h)
+        oldRange = self.ranges.get(key)
+        if oldRange == cellRange:
+            return
+        if oldRange is None:
+            self.order[key] = self.counter
+            self.counter = self.counter + 1
+        else:
+            self.removeCells(key, oldRange)
+        cx0, cy0, cx1, cy1 = cellRange
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = cellId(cx, cy)
+                keys = self.cells.get(cell)
+                if keys is None:
+                    keys = set()
+                    self.cells[cell] = keys
+                keys.add(key)
+        self.ranges[key] = cellRange
+        self.arrays = None
+
+    def removeCells(self, key, cellRange):
+        cx0, cy0, cx1, cy1 = cellRange
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = cellId(cx, cy)
+                keys = self.cells[cell]
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self.cells[cell]
+
+    def remove(self, key):
+        cellRange = self.ranges.pop(key, None)
+        if cellRange is not None:
+            self.removeCells(key, cellRange)
+            del self.order[key]
+            self.arrays = None
+
+    def rebuild(self, ships):
+        for key in [key for key in self.ranges if key not in ships]:
+            self.remove(key)
+        for key, ship in ships.items():
+            self.move(key, ship)
+
+    def queryRange(self, cellRange):
+        found = set()
+        cx0, cy0, cx1, cy1 = cellRange
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                keys = self.cells.get(cellId(cx, cy))
+                if keys is not None:
+                    found.update(keys)
+        return found
+
+    def query(self, x, y, w, h):
+        return self.queryRange(self.cellRange(x, y, w, h))
+
+    def near(self, key):
+        found = self.queryRange(self.ranges[key])
+        found.discard(key)
+        return sorted(found, key=self.order.__getitem__)
+
+    def cellArrays(self):
+        if self.arrays is None:
+            cells = []
+            keys = []
+            for cell, cellKeys in self.cells.items():
+                for key in cellKeys:
+                    cells.append(cell)
+                    keys.append(key)
+            cells = np.array(cells, dtype=np.int64)
+            keys = np.array(keys, dtype=np.int64)
+            order = np.argsort(cells, kind='stable')
+            self.arrays = (cells[order], keys[order])
+        return self.arrays
+
+    def candidatePairs(self, minX, minY, maxX, maxY):
+        # boxes are inclusive pixel bounds; returns (box index, key) for
+        # every key sharing at least one cell with the box, without repeats
+        cells, keys = self.cellArrays()
+        size = self.cellSize
+        cx0 = np.floor_divide(minX, size)
+        cy0 = np.floor_divide(minY, size)
+        ny = np.floor_divide(maxY, size) - cy0 + 1
+        counts = (np.floor_divide(maxX, size) - cx0 + 1) * ny
+        boxes, offsets = expand(counts)
+        boxCells = cellId(cx0[boxes] + offsets // ny[boxes],
+                          cy0[boxes] + offsets % ny[boxes])
+        lo = np.searchsorted(cells, boxCells, 'left')
+        hi = np.searchsorted(cells, boxCells, 'right')
+        rows, offsets = expand(hi - lo)
+        pairBoxes = boxes[rows]
+        pairKeys = keys[lo[rows] + offsets]
+        unique = np.unique(pairBoxes * CELL_SPAN + pairKeys)
+        return unique // CELL_SPAN, unique % CELL_SPAN
@@ -1,7 +1,15 @@
-from Ship import Ship, Barrier
+from Ship import Ship, Barrier, loadImage, loadAtlas
+from Ship import rotate, precomputeRotations
+from simulation import handleBarriers
+from inputCodec import encodeInputs, maskFromPressed, KEY_SPACE
+from snapshotCodec import isSnapshot, SnapshotDecoder
+from interpolation import InterpolationBuffer
 import asyncio
+import hashlib
 import json
-from pathlib import Path
+import os
+import struct
+from collections import deque
 import pygame
 import time
 import sys
@@ -11,25 +19,50 @@ RESOURCE_SERVER_PORT = '8889'
 LOOKUPSERVER_IP = '127.0.0.1'
 LOOKUPSERVER_PORT = '8888'
 
+REQUEST_HEADER = struct.Struct('<I')
+RESPONSE_HEADER = struct.Struct('<HI')
+CACHE_DIR = 'cache'
+FETCH_CONNECTIONS = 4
+SPRITE_BUNDLE = 'sprites.bundle'
+MAX_DIRTY_RECTS = 400
+PREDICTION_BUFFER_SIZE = 256
+
 
 class ResourceProtocol(asyncio.Protocol):
-    def __init__(self, filename, on_con_lost):
+    def __init__(self, on_con_lost):
         self.on_con_lost = on_con_lost
-        self.filename = filename
-        self.file = None
+        self.buffer = bytearray()
+        self.pending = deque()
 
     def connection_made(self, transport):
-        messageData = {'filename': self.filename}
-        message = json.dumps(messageData)
-        transport.write(message.encode())
+        self.transport = transport
+
+    def request(self, messageData):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(future)
+        message = json.dumps(messageData).encode()
+        self.transport.write(REQUEST_HEADER.pack(len(message)) + message)
+        return future
 
     def data_received(self, data):
-        if self.file is None:
-            self.file = open(self.filename, "wb")
-        self.file.write(data)
+        buffer = self.buffer
+        buffer.extend(data)
+        while len(buffer) >= RESPONSE_HEADER.size:
+            status, length = RESPONSE_HEADER.unpack_from(buffer, 0)
+            end = RESPONSE_HEADER.size + length
+            if len(buffer) < end:
+                break
+            body = bytes(buffer[RESPONSE_HEADER.size:end])
+            del buffer[:end]
+            future = self.pending.popleft()
+            if not future.done():
+                future.set_result((status, body))
 
     def connection_lost(self, exc):
-        self.file.close()
+        while self.pending:
+            future = self.pending.popleft()
+            if not future.done():
+                future.set_exception(ConnectionError('resource server closed'))
         self.on_con_lost.set_result(True)
 
 
@@ -63,24 +96,60 @@ class GameClientProtocol:
         self.gameData = gameData
         self.transport = None
         self.ships = {}
+        self.serverShip = None
+        self.lastSeq = 0
+        self.summary = []
         self.kicked = False
+        self.snapshots = SnapshotDecoder()
+        self.interpolation = InterpolationBuffer()
 
     def connection_made(self, transport):
         self.transport = transport
         self.transport.sendto(self.message.encode())
 
     def datagram_received(self, data, addr):
-        items = json.loads(data.decode())
-        ships = items['ships']
-        self.gameData['ships'] = ships
-        self.gameData['inputs'] = items['inputs']
-        self.ships = deserializeGameData(self.gameData)
+        if not isSnapshot(data):
+            items = json.loads(data.decode())
+            if items.get('kick', False):
+                self.gameData = {}
+                self.kicked = True
+            return
+        items = self.snapshots.decode(data)
+        if items is None:
+            return
+        ownShip = items['ships'].get(items['clientId'])
+        if ownShip is not None:
+            self.applyServerShip(ownShip)
+        if items['handshake'] == 0:
+            self.lastSeq = items['lastSeq']
+            if items['summary'] is not None:
+                self.summary = items['summary']
+            self.interpolation.push(items['timeStamp'], items['ships'],
+                                    items['bullets'], time.time())
         if items['handshake'] == 1:
             self.gameData['clientId'] = items['clientId']
             self.on_con_made.set_result(True)
-        if items.get('kick', False):
-            self.gameData = {}
-            self.kicked = True
+
+    def applyServerShip(self, data):
+        # the server's view of our own ship, kept apart from the predicted one
+        if self.serverShip is None:
+            self.serverShip = Ship.jsonDeserialize(data)
+        else:
+            self.serverShip.readJson(data)
+
+    def applyShips(self, shipData, clientId):
+        # remote ships persist between frames and are updated in place
+        ships = self.ships
+        for key, data in shipData.items():
+            if key == clientId:
+                continue
+            elif key in ships:
+                ships[key].readJson(data)
+            else:
+                ships[key] = Ship.jsonDeserialize(data)
+        for key in [key for key in ships
+                    if key != clientId and key not in shipData]:
+            del ships[key]
 
     def error_received(self, exc):
         print('Error received:', exc)
@@ -89,18 +158,15 @@ class GameClientProtocol:
         self.on_con_lost.set_result(True)
 
 
-def getValidatedShip(oldShipSet, serverShip, ship, imageName):
-    if len(oldShipSet) == 0:
-        ship = serverShip
-    else:
-        serverShipStr = json.dumps(
-            {"x": serverShip.rect.x, "y": serverShip.rect.y})
-        ship.hitpoints = serverShip.hitpoints
-        if serverShipStr not in oldShipSet:
-            ship = serverShip
-        if not ship.dead:
-            ship.setImage(imageName)
-    return ship
+def reconcile(ship, serverShip, pending, lastSeq, ships):
+    # rewind to the server's state and replay what it hasn't seen yet;
+    # shots were already spawned when the inputs were first predicted
+    while len(pending) > 0 and pending[0]['seq'] <= lastSeq:
+        pending.popleft()
+    ship.copyState(serverShip)
+    for item in pending:
+        ship.handleMovementInput(item['mask'] & ~KEY_SPACE, item['delta'],
+                                 ships)
 
 
 def getDeltaTime(oldTime):
@@ -109,59 +175,8 @@ def getDeltaTime(oldTime):
     return deltaTime, newTime
 
 
-def deserializeGameData(gameData):
-    ships = {}
-    for key, value in gameData['ships'].items():
-        ships[key] = Ship.jsonDeserialize(value)
-    return ships
-
-
-def createMessage(inputBuffer, clientId, time):
-    messageData = {"handshake": 0}
-    messageData['inputs'] = inputBuffer
-    messageData['clientId'] = clientId
-    messageData['timeStamp'] = time
-    message = json.dumps(messageData)
-    return message
-
-
-def handleShipMovements(ships, gameData, deltaTime):
-    for value in ships.values():
-        value.colliding = False
-    for key, value in ships.items():
-        if len(gameData['inputs'][key]) > 0:
-            itemInputs = gameData['inputs'][key].pop(0)
-            shipList = list(ships.values())
-            shipList.remove(value)
-            value.handleMovementInput(
-                itemInputs['pressed'], deltaTime, shipList)
-
-
-def handleBullets(ships):
-    rectDict = {}
-    for key, value in ships.items():
-        rectDict[key] = value.rect
-    for value in ships.values():
-        for bullet in value.gun.bullets:
-            oldX = bullet.rect.x
-            oldY = bullet.rect.y
-            bullet.update()
-            interpolation = bullet.interpolate(oldX, oldY)
-            for key, rect in rectDict.items():
-                collision = rect.collidelist(interpolation)
-                if collision != -1:
-                    ship = ships[key]
-                    ship.takeDamage(1)
-                    bullet.age = 1000
-        value.gun.expireOldBullets()
-
-
-def handleBarriers(ships, barriers):
-    for barrier in barriers:
-        for ship in ships.values():
-            if barrier.rect.colliderect(ship.rect):
-                ship.takeDamage(2)
-                ship.direction = ship.direction + 180
+def createMessage(inputBuffer, clientId, time, ack=0):
+    return encodeInputs(inputBuffer, clientId, time, ack)
 
 
 def userSelectServer(serverList):
@@ -171,7 +186,9 @@ def userSelectServer(serverList):
         try:
             i = 1
             for server in serverList:
-                print("{}: {}".format(i, server['serverName']))
+                print("{}: {} ({}/{})".format(
+                    i, server['serverName'], server.get('players', 0),
+                    server.get('maxPlayers', 16)))
                 i = i + 1
             selection = input("Select a server by giving a number: ")
             selValue = int(selection) - 1
@@ -203,29 +220,125 @@ def userSelectColor():
             pass
 
 
-async def fetchResource(loop, filename):
+async def openResourceConnection(loop):
     on_con_lost = loop.create_future()
     transport, protocol = await loop.create_connection(
-        lambda: ResourceProtocol(filename, on_con_lost),
+        lambda: ResourceProtocol(on_con_lost),
         RESOURCE_SERVER_IP, RESOURCE_SERVER_PORT)
-    await on_con_lost
-
-def render(barriers, ships, screen):
-    BLACK = (0, 0, 0)
-    screen.fill(BLACK)
-    for barrier in barriers:
-        screen.blit(barrier.image, barrier.rect)
-    for value in ships.values():
-        image = pygame.transform.rotate(
-            value.image, value.getDirection())
-        screen.blit(image, value.rect)
-        screen.blit(value.hpbar.image, value.hpbar.rect)
-        for bullet in value.gun.bullets:
-            transformedBullet = pygame.transform.rotate(
-                bullet.image, bullet.direction)
-            screen.blit(transformedBullet, bullet.rect)
-    pygame.display.update()
-    pass
+    return transport, protocol
+
+
+def cachePath(entry):
+    return os.path.join(CACHE_DIR, entry['hash'])
+
+
+def isCached(entry):
+    # the assets are small, so every hit is checked against its hash
+    path = cachePath(entry)
+    if not os.path.isfile(path) or os.path.getsize(path) != entry['size']:
+        return False
+    with open(path, 'rb') as resource:
+        return hashlib.sha256(resource.read()).hexdigest() == entry['hash']
+
+
+def storeAsset(entry, data):
+    if len(data) != entry['size']:
+        return False
+    if hashlib.sha256(data).hexdigest() != entry['hash']:
+        return False
+    path = cachePath(entry)
+    with open(path + '.part', 'wb') as resource:
+        resource.write(data)
+    os.replace(path + '.part', path)
+    return True
+
+
+async def fetchMissing(protocol, queue):
+    while not queue.empty():
+        entry = queue.get_nowait()
+        status, data = await protocol.request({'hash': entry['hash']})
+        if status != 200 or not storeAsset(entry, data):
+            print("Could not fetch asset {}".format(entry['hash']))
+
+
+async def syncAssets(loop, names=None):
+    # returns asset name -> local path, downloading only the assets whose
+    # content hash is not in the cache yet
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    manifestPath = os.path.join(CACHE_DIR, 'manifest.json')
+    transports = []
+    try:
+        transport, protocol = await openResourceConnection(loop)
+        transports.append(transport)
+        status, data = await protocol.request({'manifest': 1})
+        if status != 200:
+            raise ValueError('manifest request failed: {}'.format(status))
+        manifest = json.loads(data.decode())
+        if names is not None:
+            manifest = {name: manifest[name] for name in names
+                        if name in manifest}
+        missing = [entry for entry in manifest.values()
+                   if not isCached(entry)]
+        if len(missing) > 0:
+            queue = asyncio.Queue()
+            for entry in missing:
+                queue.put_nowait(entry)
+            protocols = [protocol]
+            for i in range(min(len(missing), FETCH_CONNECTIONS) - 1):
+                transport, extra = await openResourceConnection(loop)
+                transports.append(transport)
+                protocols.append(extra)
+            await asyncio.gather(*[fetchMissing(connection, queue)
+                                   for connection in protocols])
+        with open(manifestPath, 'w') as manifestFile:
+            json.dump(manifest, manifestFile)
+    except (OSError, ValueError):
+        # play with whatever an earlier run left in the cache
+        manifest = {}
+        if os.path.isfile(manifestPath):
+            with open(manifestPath) as manifestFile:
+                manifest = json.load(manifestFile)
+    finally:
+        for transport in transports:
+            transport.close()
+    paths = {}
+    for name, entry in manifest.items():
+        if isCached(entry):
+            paths[name] = cachePath(entry)
+    return paths
+
+class Renderer():
+    def __init__(self, screen, barriers):
+        self.screen = screen
+        self.background = pygame.Surface(screen.get_size()).convert()
+        self.background.fill((0, 0, 0))
+        for barrier in barriers:
+            self.background.blit(barrier.image, barrier.rect)
+        self.dirty = []
+        screen.blit(self.background, (0, 0))
+        pygame.display.update()
+
+    def render(self, ships, bullets):
+        screen = self.screen
+        background = self.background
+        # erase last frame's sprites, then redraw and flip only the
+        # regions that were touched in either frame
+        for rect in self.dirty:
+            screen.blit(background, rect, rect)
+        sprites = []
+        for value in ships.values():
+            sprites.append((rotate(value.image, value.getDirection()),
+                            (value.x, value.y)))
+            sprites.append((value.hpbar.image, value.hpbar.rect))
+        bulletImage = loadImage('assets/bullet.png')
+        for owner, bulletId, x, y, direction, age, bulletTime in bullets:
+            sprites.append((rotate(bulletImage, direction), (x, y)))
+        drawn = screen.blits(sprites)
+        if len(self.dirty) + len(drawn) > MAX_DIRTY_RECTS:
+            pygame.display.update()
+        else:
+            pygame.display.update(self.dirty + drawn)
+        self.dirty = drawn
 
 async def game(protocol, transport, shipImageName):
     pygame.init()
@@ -237,50 +350,62 @@ async def game(protocol, transport, shipImageName):
         Barrier((0, 0), (40, 900)),
         Barrier((1860, 0), (40, 900)),
     ]
+    precomputeRotations(['assets/ship.png', 'assets/bullet.png',
+                         'assets/explosion.png', shipImageName])
+    renderer = Renderer(screen, barriers)
     clock = pygame.time.Clock()
     FPS = 60
     gameData = protocol.gameData
     clientId = gameData['clientId']
     oldTime = time.time()
     lastSentTime = time.time()
-    oldShipSet = []
     inputBuffer = []
-    ship = None
+    pending = deque(maxlen=PREDICTION_BUFFER_SIZE)
+    sequence = 1
+    serverShip = protocol.serverShip
+    ship = Ship(serverShip.x, serverShip.y, imageName=shipImageName)
+    ship.copyState(serverShip)
+    appliedTick = 0
+    bullets = []
     while True:
         if protocol.kicked:
             print("You have been kicked from the server")
             quit()
         ships = protocol.ships
-        serverShip = ships[str(clientId)]
-        ship = getValidatedShip(
-            oldShipSet, serverShip, ship, shipImageName)
-        ships[str(clientId)] = ship
+        sample = protocol.interpolation.sample(time.time())
+        if sample is not None:
+            protocol.applyShips(sample[0], clientId)
+            bullets = sample[1]
+        otherShips = [value for key, value in ships.items()
+                      if key != clientId]
+        if protocol.snapshots.lastTick != appliedTick:
+            appliedTick = protocol.snapshots.lastTick
+            reconcile(ship, protocol.serverShip, pending, protocol.lastSeq,
+                      otherShips)
+        ships[clientId] = ship
         deltaTime, newTime = getDeltaTime(oldTime)
         oldTime = newTime
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 quit()
-        pressed = pygame.key.get_pressed()
-        inputStruct = {"pressed": pressed,
+        mask = maskFromPressed(pygame.key.get_pressed())
+        inputStruct = {"seq": sequence, "mask": mask,
                        "delta": deltaTime, "timestamp": newTime}
-        gameData['inputs'][str(clientId)] = [inputStruct]
+        sequence = sequence + 1
         inputBuffer.append(inputStruct)
-        handleShipMovements(ships, gameData, deltaTime)
-        handleBullets(ships)
-        handleBarriers(ships, barriers)
-        render(barriers, ships, screen)
+        pending.append(inputStruct)
+        ship.handleMovementInput(mask, deltaTime, otherShips)
+        # our shots show up once the server's snapshots carry them
+        ship.gun.fired.clear()
+        handleBarriers({clientId: ship}, barriers)
+        renderer.render(ships, bullets)
         elapsed = newTime - lastSentTime
-        oldShipSet.append(json.dumps(
-            {"x": ship.rect.x, "y": ship.rect.y}))
         if elapsed >= 0.05:
-            message = createMessage(inputBuffer, clientId, newTime)
-            transport.sendto(message.encode())
+            message = createMessage(inputBuffer, clientId, newTime,
+                                    protocol.snapshots.lastTick)
+            transport.sendto(message)
             lastSentTime = newTime
             inputBuffer = []
-            if len(oldShipSet) > 15:
-                oldShipSet = oldShipSet[-30:]
-        if ship.dead:
-            oldShipSet = []
         await asyncio.sleep(0.0)
         clock.tick(FPS)
 
@@ -288,8 +413,7 @@ async def main():
     loop = asyncio.get_running_loop()
     on_con_lost = loop.create_future()
     on_con_made = loop.create_future()
-    message = '{"handshake": 1}'
-    lookupMessageData = {'type': 'query'}
+    lookupMessageData = {'type': 'query', 'freeSlots': 1, 'order': 'load'}
     gotServerList = loop.create_future()
     lookupTransport, lookUpProtocol = await loop.create_connection(
         lambda: LookupProtocol(
@@ -297,15 +421,20 @@ async def main():
         LOOKUPSERVER_IP, LOOKUPSERVER_PORT
     )
     await gotServerList
+    assetPaths = await syncAssets(loop, [SPRITE_BUNDLE])
+    if SPRITE_BUNDLE not in assetPaths:
+        print("Could not get the sprites from the resource server")
+        lookupTransport.close()
+        return
+    with open(assetPaths[SPRITE_BUNDLE], 'rb') as bundle:
+        loadAtlas(bundle.read())
     color = userSelectColor()
     shipImageName = color + '.png'
-    shipImage = Path(shipImageName)
-    if not shipImage.is_file():
-        await fetchResource(loop, shipImageName)
     server = userSelectServer(lookUpProtocol.serverList)
     if not server:
         print("No servers were online :(")
         sys.exit(0)
+    message = json.dumps({'handshake': 1, 'room': server.get('room')})
     gameData = {}
     transport, protocol = await loop.create_datagram_endpoint(
         lambda: GameClientProtocol(
@@ -319,4 +448,5 @@ async def main():
         transport.close()
 
 
-asyncio.run(main())
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,223 +1,550 @@
-from Ship import Ship, Barrier, Bullet
+from simulation import ShipState, BarrierState, BulletPool
+from simulation import handleBullets, handleBarriers, handleRespawns
+from simulation import PositionHistory, HISTORY_TICKS, freezeTime
+from interpolation import INTERPOLATION_DELAY
+from broadphase import SpatialHash, GRID_MIN_SHIPS
+from inputCodec import decodeMessage
+from snapshotCodec import SnapshotEncoder, encodeSnapshot, FLAG_HANDSHAKE
+from snapshotCodec import INTEREST_RADIUS
+from inputRing import InputRing
+from tickScheduler import TickScheduler, POLICIES, SKIP
+from tickMetrics import TickMetrics, startMetricsServer, logMetrics
+from inputLog import InputLogWriter, newSeed, stateChecksum
+import argparse
 import asyncio
+import heapq
 import json
-import pygame
+import multiprocessing
 import random
+import struct
 import time
-import sys
 
 IP = '127.0.0.1'
 PORT = '9999'
 LOOKUP_SERVER_PORT = '8888'
 LOOKUP_SERVER_IP = '127.0.0.1'
+MAX_PLAYERS = 16
+WORLD_SIZE = (1900, 900)
+MAX_CLIENT_ID = (1 << 20) - 1
+MAX_REWIND = 0.2
+RTT_SMOOTHING = 0.2
+HEARTBEAT_INTERVAL = 10
+MAX_UNANSWERED = 3
+MAX_BACKOFF = 60
+CLIENT_TIMEOUT = 10
 
 
-class LookupProtocol(asyncio.Protocol):
-    def __init__(self, messageData, on_con_lost):
-        self.messageData = messageData
+class HeartbeatProtocol:
+    def __init__(self, on_con_lost):
         self.on_con_lost = on_con_lost
+        self.acks = 0
 
     def connection_made(self, transport):
-        transport.write(json.dumps(self.messageData).encode())
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.acks = self.acks + 1
 
-    def data_received(self, data):
-        message = data.decode()
-        information = json.loads(message)
+    def error_received(self, exc):
+        if not self.on_con_lost.done():
+            self.on_con_lost.set_result(exc)
 
     def connection_lost(self, exc):
-        self.on_con_lost.set_result(True)
+        if not self.on_con_lost.done():
+            self.on_con_lost.set_result(exc)
 
 
-class GameServerProtocol:
-    def __init__(self):
+def createBarriers():
+    return [
+        BarrierState((0, 0), (1900, 40)),
+        BarrierState((0, 860), (1900, 40)),
+        BarrierState((0, 0), (40, 900)),
+        BarrierState((1860, 0), (40, 900)),
+    ]
+
+
+class Room():
+    def __init__(self, roomId, serverName, interestRadius=INTEREST_RADIUS,
+                 maxRewind=MAX_REWIND, metrics=None, recorder=None):
+        self.roomId = roomId
+        self.serverName = serverName
         self.item = {}
+        self.bullets = BulletPool()
         self.clients = {}
         self.timeStamps = {}
         self.inputBuffer = {}
+        # input counters of clients that already left
+        self.inputTotals = {'received': 0, 'duplicates': 0, 'stale': 0,
+                            'overflows': 0}
+        self.acks = {}
+        self.lastSeq = {}
+        self.barriers = createBarriers()
+        self.snapshot = SnapshotEncoder(interestRadius=interestRadius,
+                                        worldSize=WORLD_SIZE)
+        self.grid = SpatialHash()
+        self.history = PositionHistory(HISTORY_TICKS, MAX_PLAYERS)
+        self.maxRewind = maxRewind
+        self.sentTimes = {}
+        self.rtt = {}
+        self.metrics = metrics
+        self.recorder = recorder
+        self.tick = 0
+
+    def playerCount(self):
+        return len(self.clients)
+
+    def isFull(self):
+        return len(self.clients) >= MAX_PLAYERS
+
+    def join(self, clientId, addr, position=None):
+        if position is None:
+            position = (random.randint(0, 720), random.randint(0, 480))
+        x, y = position
+        if self.recorder is not None:
+            self.recorder.join(self.roomId, clientId, x, y)
+        ship = ShipState(x, y)
+        self.clients[clientId] = addr
+        self.item[clientId] = ship
+        self.timeStamps[clientId] = time.time()
+        self.inputBuffer[clientId] = InputRing()
+        self.acks[clientId] = 0
+        self.lastSeq[clientId] = 0
+        return encodeSnapshot({clientId: ship}, BulletPool(1),
+                              timeStamp=time.time(), clientId=clientId,
+                              flags=FLAG_HANDSHAKE)
+
+    def receive(self, information):
+        client = information['clientId']
+        inputs = information['inputs']
+        newTime = information['timeStamp']
+        ring = self.inputBuffer[client]
+        for item in inputs:
+            ring.push(item)
+        self.timeStamps[client] = newTime
+        ack = information.get('ack', 0)
+        if ack > self.acks[client]:
+            self.acks[client] = ack
+            sentTime = self.sentTimes.get(ack)
+            if sentTime is not None:
+                rtt = time.time() - sentTime
+                oldRtt = self.rtt.get(client, rtt)
+                self.rtt[client] = oldRtt + (rtt - oldRtt) * RTT_SMOOTHING
+
+    def lags(self):
+        # a shot was aimed at what the shooter saw: the snapshot it rendered
+        # is a round trip plus the interpolation delay old
+        lags = {}
+        for key, rtt in self.rtt.items():
+            lags[key] = min(rtt + INTERPOLATION_DELAY, self.maxRewind)
+        return lags
+
+    def drainInputs(self):
+        inputs = {}
+        for key, ring in self.inputBuffer.items():
+            inputs[key] = ring.drain()
+        return inputs
+
+    def retireInputs(self, ring):
+        stats = ring.stats()
+        for name in self.inputTotals:
+            self.inputTotals[name] = self.inputTotals[name] + stats[name]
+
+    def inputStats(self):
+        stats = dict(self.inputTotals, buffered=0)
+        for ring in self.inputBuffer.values():
+            for name, value in ring.stats().items():
+                stats[name] = stats[name] + value
+        return stats
+
+    def expiredClients(self, now):
+        expired = []
+        for key, timeStamp in self.timeStamps.items():
+            if now - timeStamp >= CLIENT_TIMEOUT:
+                expired.append(key)
+        return expired
+
+    def step(self, transport):
+        # everything a tick takes from outside the simulation is gathered
+        # here, so a recorded tick can be fed back through advance
+        timeStamp = time.time()
+        inputs = self.drainInputs()
+        lags = self.lags()
+        expired = self.expiredClients(timeStamp)
+        recorder = self.recorder
+        if recorder is None:
+            return self.advance(transport, timeStamp, inputs, lags, expired)
+        seed = newSeed()
+        recorder.beginTick(self, timeStamp, seed, inputs, lags, expired)
+        removed = self.advance(transport, timeStamp, inputs, lags, expired,
+                               seed)
+        recorder.endTick(stateChecksum(self.item, self.bullets))
+        return removed
+
+    def advance(self, transport, timeStamp, inputs, lags, expired,
+                seed=None):
+        gameData = self.item
+        clients = self.clients
+        grid = self.grid if len(self.item) >= GRID_MIN_SHIPS else None
+        snapshot = self.snapshot
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.start()
+        if seed is not None:
+            random.seed(seed)
+        freezeTime(timeStamp)
+        self.tick = self.tick + 1
+        newGameData = {}
+        for value in gameData.values():
+            value.colliding = False
+        for key, value in gameData.items():
+            newGameData[key] = gameData[key].copy()
+        newBullets = self.bullets.copy()
+        if grid is not None:
+            grid.rebuild(newGameData)
+        if metrics is not None:
+            metrics.lap('copy')
+        for key, items in inputs.items():
+            if len(items) > 0:
+                self.lastSeq[key] = items[-1]['seq']
+        timeline = formTimeLineData(inputs)
+        simulateMovements(newGameData, timeline, grid)
+        if metrics is not None:
+            metrics.lap('movements')
+        snapshot.capture(self.tick, timeStamp, gameData, self.bullets)
+        self.history.record(timeStamp, gameData)
+        self.sentTimes[self.tick] = timeStamp
+        self.sentTimes.pop(self.tick - HISTORY_TICKS, None)
+        if metrics is not None:
+            metrics.lap('capture')
+        handleBullets(newGameData, newBullets, grid, self.history, lags)
+        if metrics is not None:
+            metrics.lap('bullets')
+        handleBarriers(newGameData, self.barriers, grid)
+        handleRespawns(newGameData)
+        if metrics is not None:
+            metrics.lap('barriers')
+        for key, value in clients.items():
+            message = snapshot.encodeFor(
+                key, newGameData[key], self.acks[key], self.lastSeq[key])
+            if metrics is not None:
+                metrics.lap('encode')
+            transport.sendto(message, value)
+            if metrics is not None:
+                metrics.sent(len(message))
+                metrics.lap('send')
+        removed = []
+        for key, value in newGameData.items():
+            if key not in expired:
+                gameData[key] = value
+            else:
+                del gameData[key]
+                del clients[key]
+                del self.timeStamps[key]
+                self.retireInputs(self.inputBuffer.pop(key))
+                del self.acks[key]
+                del self.lastSeq[key]
+                self.snapshot.forget(key)
+                self.history.release(key)
+                self.rtt.pop(key, None)
+                newBullets.removeOwner(key)
+                removed.append(key)
+        self.item = gameData
+        self.bullets = newBullets
+        freezeTime(None)
+        if metrics is not None:
+            metrics.entities(self.roomId, len(clients), len(gameData),
+                             newBullets.count)
+            metrics.inputs(self.roomId, self.inputStats())
+            metrics.lap('cleanup')
+        return removed
+
+
+class GameServerProtocol:
+    def __init__(self, rooms, metrics=None):
+        self.rooms = rooms
+        self.clientRooms = {}
+        self.metrics = metrics
 
     def connection_made(self, transport):
         self.transport = transport
 
+    def selectRoom(self, roomId):
+        if roomId is not None:
+            room = self.rooms.get(roomId)
+            if room is None or room.isFull():
+                return None
+            return room
+        # clients that don't name a room go to the fullest one with space
+        best = None
+        for room in self.rooms.values():
+            if not room.isFull() and (
+                    best is None or room.playerCount() > best.playerCount()):
+                best = room
+        return best
+
+    def newClientId(self):
+        while True:
+            clientId = random.randint(0, MAX_CLIENT_ID)
+            if clientId not in self.clientRooms:
+                return clientId
+
+    def removeClients(self, clientIds):
+        for clientId in clientIds:
+            self.clientRooms.pop(clientId, None)
+
     def datagram_received(self, data, addr):
+        if self.metrics is not None:
+            self.metrics.received(len(data))
         try:
-            message = data.decode()
-            information = json.loads(message)
-            if information['handshake'] == 1 and len(self.clients) <= 16:
-                clientId = random.randint(0, 2000)
-                x = random.randint(0, 720)
-                y = random.randint(0, 480)
-                ship = Ship(x, y)
-                replyData = {
-                    'handshake': 1,
-                    'clientId': clientId,
-                    'ships': {
-                        clientId: ship.jsonSerialize()
-                    },
-                    'inputs': {},
-                }
-                self.transport.sendto(json.dumps(replyData).encode(), addr)
-                self.clients[clientId] = addr
-                self.item[clientId] = ship
-                self.timeStamps[clientId] = time.time()
-                self.inputBuffer[clientId] = []
+            information = decodeMessage(data)
+            room = None
+            if information['handshake'] == 1:
+                room = self.selectRoom(information.get('room'))
+            if room is not None:
+                clientId = self.newClientId()
+                reply = room.join(clientId, addr)
+                self.transport.sendto(reply, addr)
+                self.clientRooms[clientId] = room
             else:
                 try:
-                    client = information['clientId']
-                    inputs = information['inputs']
-                    ship = self.item[client]
-                    newTime = information['timeStamp']
-                    self.inputBuffer[client] = self.inputBuffer[client] + inputs
-                    self.timeStamps[client] = newTime
+                    room = self.clientRooms[information['clientId']]
+                    room.receive(information)
                 except KeyError:
                     replydata = { 'kick': True }
                     self.transport.sendto(json.dumps(replydata).encode(), addr)
-        except json.JSONDecodeError:
+        except (ValueError, struct.error):
             pass
         except KeyError:
             pass
 
 
-
-def handleBullets(ships):
-    rectDict = {}
-    for key, value in ships.items():
-        rectDict[key] = value.rect
-    for value in ships.values():
-        for bullet in value.gun.bullets:
-            oldX = bullet.rect.x
-            oldY = bullet.rect.y
-            bullet.update()
-            interpolation = bullet.interpolate(oldX, oldY)
-            for key, rect in rectDict.items():
-                collision = rect.collidelist(interpolation)
-                if collision != -1:
-                    ship = ships[key]
-                    ship.takeDamage(1)
-                    bullet.age = 1000
-            for rect in interpolation:
-                suf = pygame.Surface((10, 10))
-                suf.fill((255, 255, 255))
-        value.gun.expireOldBullets()
-
-
-def handleBarriers(ships, barriers):
-    for barrier in barriers:
-        for ship in ships.values():
-            if barrier.rect.colliderect(ship.rect):
-                ship.takeDamage(2)
-                ship.direction = ship.direction + 180
-
-
-def handleRespawns(ships):
-    for value in ships.values():
-        value.spawn()
-
-
-async def declareServer(loop, serverName, ip, port):
-    lookupMessageData = {
-        'type': 'declaration',
-        'serverName': serverName,
-        'ip': ip,
-        'port': port
+def heartbeatMessage(room, port, scheduler):
+    return {
+        'type': 'heartbeat',
+        'serverName': room.serverName,
+        'ip': IP,
+        'port': port,
+        'room': room.roomId,
+        'players': room.playerCount(),
+        'maxPlayers': MAX_PLAYERS,
+        'tickRate': scheduler.tickRate,
+        'tickP50': round(scheduler.percentile(0.5) * 1000, 3),
+        'tickP99': round(scheduler.percentile(0.99) * 1000, 3)
     }
-    on_con_lost = loop.create_future()
-    lookupTransport, lookUpProtocol = await loop.create_connection(
-        lambda: LookupProtocol(
-            lookupMessageData, on_con_lost),
-        LOOKUP_SERVER_IP,
-        LOOKUP_SERVER_PORT
-    )
-    await on_con_lost
-    lookupTransport.close()
-
-
-def formTimeLineData(protocol):
-    timeline = []
-    for key, value in protocol.inputBuffer.items():
-        for item in value:
-            timelineValue = dict(item)
-            timelineValue['clientId'] = key
-            timeline.append(timelineValue)
-    timeline.sort(key=lambda value: value['timestamp'])
-    return timeline
-
-def simulateMovements(newGameData, timeline):
-    for item in timeline:
-        key = item['clientId']
+
+
+async def heartbeat(loop, rooms, port, scheduler,
+                    interval=HEARTBEAT_INTERVAL):
+    # runs beside the tick loop so a slow or missing lookup server never
+    # stalls the simulation; the socket is rebuilt with backoff on errors
+    # or when the lookup server stops answering
+    backoff = 1
+    while True:
+        on_con_lost = loop.create_future()
+        try:
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: HeartbeatProtocol(on_con_lost),
+                remote_addr=(LOOKUP_SERVER_IP, LOOKUP_SERVER_PORT))
+        except OSError:
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+            continue
+        try:
+            unanswered = 0
+            while not on_con_lost.done() and unanswered < MAX_UNANSWERED:
+                acks = protocol.acks
+                for room in rooms.values():
+                    message = heartbeatMessage(room, port, scheduler)
+                    transport.sendto(json.dumps(message).encode())
+                await asyncio.wait([on_con_lost], timeout=interval)
+                if protocol.acks > acks:
+                    unanswered = 0
+                    backoff = 1
+                else:
+                    unanswered = unanswered + 1
+        finally:
+            transport.close()
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, MAX_BACKOFF)
+
+
+def formTimeLineData(inputs):
+    # every client's inputs are already in timestamp order, so merge the
+    # buffers; heap entries are reused in place and ties keep client order
+    heap = []
+    for order, (key, items) in enumerate(inputs.items()):
+        if len(items) > 0:
+            heap.append([items[0]['timestamp'], order, key, items, 0])
+    heapq.heapify(heap)
+    while heap:
+        entry = heap[0]
+        key = entry[2]
+        items = entry[3]
+        index = entry[4]
+        yield key, items[index]
+        index = index + 1
+        if index < len(items):
+            entry[0] = items[index]['timestamp']
+            entry[4] = index
+            heapq.heapreplace(heap, entry)
+        else:
+            heapq.heappop(heap)
+
+def simulateMovements(newGameData, timeline, grid=None):
+    for key, item in timeline:
         ship = newGameData[key]
         deltaTime = item['delta']
-        pressed = item['pressed']
-        ships = list(newGameData.values())
-        ships.remove(ship)
-        ship.handleMovementInput(pressed, deltaTime, ships)
-        newGameData[key] = ship
-
-async def game(transport, protocol, loop, serverName, port):
-    barriers = [
-        Barrier((0, 0), (1900, 40)),
-        Barrier((0, 860), (1900, 40)),
-        Barrier((0, 0), (40, 900)),
-        Barrier((1860, 0), (40, 900)),
-    ]
-    heartBeat = time.time()
+        mask = item['mask']
+        if grid is None:
+            ships = list(newGameData.values())
+            ships.remove(ship)
+            ship.handleMovementInput(mask, deltaTime, ships)
+            continue
+        nearKeys = grid.near(key)
+        ships = [newGameData[nearKey] for nearKey in nearKeys]
+        ship.handleMovementInput(mask, deltaTime, ships)
+        grid.move(key, ship)
+        for nearKey in nearKeys:
+            grid.move(nearKey, newGameData[nearKey])
+
+async def game(transport, protocol, scheduler):
+    metrics = protocol.metrics
     while True:
-        gameData = protocol.item
-        clients = protocol.clients
-        messageData = {}
-        messageData["inputs"] = {}
-        messageData["ships"] = {}
-        messageData["handshake"] = 0
-        messageData["timeStamp"] = time.time()
-        newGameData = {}
-        for value in gameData.values():
-            value.colliding = False
-        for key, value in gameData.items():
-            newGameData[key] = gameData[key].deepCopy()
-        timeline = formTimeLineData(protocol)
-        simulateMovements(newGameData, timeline)
-        for key, value in gameData.items():
-            messageData["ships"][key] = value.jsonSerialize()
-            messageData["inputs"][key] = protocol.inputBuffer[key]
-        handleBullets(newGameData)
-        handleBarriers(newGameData, barriers)
-        handleRespawns(newGameData)
-        for key, value in clients.items():
-            messageData["clientId"] = key
-            messageData["ships"][key] = newGameData[key].jsonSerialize()
-            message = json.dumps(messageData)
-            transport.sendto(message.encode(), value)
-            protocol.inputBuffer[key] = []
-            messageData["ships"][key] = gameData[key].jsonSerialize()
-        for key, value in newGameData.items():
-            timeStamp = protocol.timeStamps.get(key)
-            if time.time() - timeStamp < 10:
-                gameData[key] = value
-            else:
-                del gameData[key]
-                del clients[key]
-        protocol.item = gameData
-        if time.time() - heartBeat > 15:
-            heartBeat = time.time()
-            await declareServer(loop, serverName, IP, port)
-        await asyncio.sleep(0.05)
+        scheduler.beginTick()
+        for room in protocol.rooms.values():
+            protocol.removeClients(room.step(transport))
+        await scheduler.waitNextTick()
+        if metrics is not None:
+            metrics.observeTick(scheduler.lastDuration)
 
-async def main(serverName='a server', port=PORT):
+def createRooms(serverName, roomCount, firstRoom=0,
+                interestRadius=INTEREST_RADIUS, maxRewind=MAX_REWIND,
+                metrics=None, recorder=None):
+    rooms = {}
+    for roomId in range(firstRoom, firstRoom + roomCount):
+        name = serverName
+        if roomId > 0 or roomCount > 1:
+            name = '{} #{}'.format(serverName, roomId + 1)
+        rooms[roomId] = Room(roomId, name, interestRadius, maxRewind,
+                             metrics, recorder)
+    return rooms
+
+async def main(serverName='a server', port=PORT, tickRate=20, policy=SKIP,
+               roomCount=1, firstRoom=0, interestRadius=INTEREST_RADIUS,
+               maxRewind=MAX_REWIND, metricsPort=None, metricsLog=None,
+               recordPath=None):
     print("Starting UDP server")
     loop = asyncio.get_running_loop()
-    await declareServer(loop, serverName, IP, port)
+    scheduler = TickScheduler(tickRate, policy)
+    # without an endpoint or a log the tick loop skips every measurement
+    metrics = None
+    if metricsPort or metricsLog:
+        metrics = TickMetrics(scheduler.period)
+    recorder = None
+    if recordPath:
+        recorder = InputLogWriter(recordPath, {
+            'serverName': serverName, 'tickRate': tickRate,
+            'interestRadius': interestRadius, 'maxRewind': maxRewind})
+    rooms = createRooms(serverName, roomCount, firstRoom, interestRadius,
+                        maxRewind, metrics, recorder)
     transport, protocol = await loop.create_datagram_endpoint(
-        lambda: GameServerProtocol(),
+        lambda: GameServerProtocol(rooms, metrics),
         local_addr=(IP, port))
+    tasks = [loop.create_task(heartbeat(loop, rooms, port, scheduler))]
+    metricsServer = None
+    if metricsPort:
+        metricsServer = await startMetricsServer(metrics, scheduler, IP,
+                                                 metricsPort)
+    if metricsLog:
+        tasks.append(loop.create_task(
+            logMetrics(metrics, scheduler, metricsLog)))
     try:
-        await game(transport, protocol, loop, serverName, port)
+        await game(transport, protocol, scheduler)
     finally:
+        for task in tasks:
+            task.cancel()
+        if metricsServer is not None:
+            metricsServer.close()
+        if recorder is not None:
+            recorder.close()
         transport.close()
         quit()
 
+def runWorker(serverName, port, tickRate, policy, roomCount, firstRoom,
+              interestRadius, maxRewind, metricsPort, metricsLog,
+              recordPath):
+    asyncio.run(main(serverName, port, tickRate, policy, roomCount,
+                     firstRoom, interestRadius, maxRewind, metricsPort,
+                     metricsLog, recordPath))
+
+def runWorkers(serverName, port, tickRate, policy, roomCount, workers,
+               interestRadius=INTEREST_RADIUS, maxRewind=MAX_REWIND,
+               metricsPort=None, metricsLog=None, recordPath=None):
+    # every worker process owns its own UDP port and an equal share of the
+    # rooms, and sends its own heartbeats
+    processes = []
+    firstRoom = 0
+    for worker in range(workers):
+        share = roomCount // workers + (1 if worker < roomCount % workers
+                                        else 0)
+        process = multiprocessing.Process(
+            target=runWorker,
+            args=(serverName, str(int(port) + worker), tickRate, policy,
+                  share, firstRoom, interestRadius, maxRewind,
+                  metricsPort + worker if metricsPort else None,
+                  metricsLog,
+                  '{}.{}'.format(recordPath, worker) if recordPath
+                  else None))
+        process.start()
+        processes.append(process)
+        firstRoom = firstRoom + share
+    for process in processes:
+        process.join()
+
 if __name__ == '__main__':
-    if len(sys.argv) == 3:
-        serverName = sys.argv[1]
-        port = sys.argv[2]
-        asyncio.run(main(serverName, port))
+    parser = argparse.ArgumentParser(description='SpaceShooter game server')
+    parser.add_argument('serverName', nargs='?', default='a server')
+    parser.add_argument('port', nargs='?', default=PORT)
+    parser.add_argument('--tick-rate', type=int, default=20,
+                        help='simulation ticks per second, e.g. 20, 30, 60')
+    parser.add_argument('--overrun-policy', choices=POLICIES, default=SKIP,
+                        help='run late ticks back to back or skip them')
+    parser.add_argument('--rooms', type=int, default=1,
+                        help='number of independent matches to host')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes to spread the rooms over, each on '
+                        'its own port counting up from the given one')
+    parser.add_argument('--interest-radius', type=int,
+                        default=INTEREST_RADIUS,
+                        help='only send entities in the 256 px cells within '
+                        'this many pixels of the cell holding a client\'s '
+                        'ship, counted per axis; off by default, 0 sends '
+                        'everything')
+    parser.add_argument('--max-rewind', type=int,
+                        default=int(MAX_REWIND * 1000),
+                        help='lag compensation limit in milliseconds, '
+                        '0 tests hits against current positions')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='serve tick metrics in Prometheus text format '
+                        'on this local TCP port, workers count up from it; '
+                        '0 turns the endpoint off')
+    parser.add_argument('--metrics-log', type=float, default=0,
+                        help='print tick metrics as a JSON line every this '
+                        'many seconds, 0 turns the log off')
+    parser.add_argument('--record', metavar='PATH', default=None,
+                        help='append every tick\'s inputs and random seed '
+                        'to this log for benchmarks/replayLog.py, workers '
+                        'add their index to the name')
+    args = parser.parse_args()
+    interestRadius = args.interest_radius or None
+    maxRewind = args.max_rewind / 1000
+    if args.workers > 1:
+        runWorkers(args.serverName, args.port, args.tick_rate,
+                   args.overrun_policy, args.rooms,
+                   min(args.workers, args.rooms), interestRadius, maxRewind,
+                   args.metrics_port, args.metrics_log, args.record)
     else:
-        asyncio.run(main())
+        asyncio.run(main(args.serverName, args.port, args.tick_rate,
+                         args.overrun_policy, args.rooms, 0, interestRadius,
+                         maxRewind, args.metrics_port, args.metrics_log,
+                         args.record))
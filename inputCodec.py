@@ -0,0 +1,90 @@
+import json
+import struct
+
+INPUT_VERSION = 3
+INPUT_VERSIONS = (2, 3)
+
+KEY_W = 1
+KEY_A = 2
+KEY_S = 4
+KEY_D = 8
+KEY_SPACE = 16
+
+# pygame keycodes (K_w, K_a, K_s, K_d, K_SPACE) of the only keys
+# Ship.handleMovementInput reads
+KEYCODES = ((119, KEY_W), (97, KEY_A), (115, KEY_S), (100, KEY_D),
+            (32, KEY_SPACE))
+
+# version, clientId, timeStamp, input count, last received snapshot tick
+HEADER = struct.Struct('<BIdHI')
+# version 2 packets carry no acknowledged tick
+HEADER_V2 = struct.Struct('<BIdH')
+# sequence, key mask, delta in 0.1 ms, timestamp
+INPUT = struct.Struct('<IBHd')
+MAX_DELTA = 0xFFFF
+
+
+def maskFromPressed(pressed):
+    mask = 0
+    for keycode, bit in KEYCODES:
+        if pressed[keycode]:
+            mask = mask | bit
+    return mask
+
+
+def encodeDelta(deltaTime):
+    return min(int(round(deltaTime * 10000)), MAX_DELTA)
+
+
+def encodeInputs(inputBuffer, clientId, timeStamp, ack=0):
+    data = bytearray(HEADER.size + INPUT.size * len(inputBuffer))
+    HEADER.pack_into(data, 0, INPUT_VERSION, clientId, timeStamp,
+                     len(inputBuffer), ack)
+    offset = HEADER.size
+    for item in inputBuffer:
+        INPUT.pack_into(data, offset, item['seq'], item['mask'],
+                        encodeDelta(item['delta']), item['timestamp'])
+        offset = offset + INPUT.size
+    return bytes(data)
+
+
+def decodeInputs(data):
+    if data[0] == INPUT_VERSION:
+        header = HEADER
+        version, clientId, timeStamp, count, ack = HEADER.unpack_from(data, 0)
+    else:
+        header = HEADER_V2
+        version, clientId, timeStamp, count = HEADER_V2.unpack_from(data, 0)
+        ack = 0
+    end = header.size + count * INPUT.size
+    if version not in INPUT_VERSIONS or len(data) < end:
+        raise ValueError('malformed input packet')
+    inputs = []
+    view = memoryview(data)[header.size:end]
+    for seq, mask, delta, timestamp in INPUT.iter_unpack(view):
+        inputs.append({'seq': seq, 'mask': mask,
+                       'delta': delta / 10000, 'timestamp': timestamp})
+    return {'handshake': 0, 'clientId': clientId,
+            'timeStamp': timeStamp, 'inputs': inputs, 'ack': ack}
+
+
+def decodeLegacyInputs(inputs):
+    decoded = []
+    for item in inputs:
+        decoded.append({'seq': None, 'mask': maskFromPressed(item['pressed']),
+                        'delta': item['delta'],
+                        'timestamp': item['timestamp']})
+    return decoded
+
+
+def isBinaryInput(data):
+    return len(data) > 0 and data[0] in INPUT_VERSIONS
+
+
+def decodeMessage(data):
+    if isBinaryInput(data):
+        return decodeInputs(data)
+    information = json.loads(data.decode())
+    if 'inputs' in information:
+        information['inputs'] = decodeLegacyInputs(information['inputs'])
+    return information
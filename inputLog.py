@@ -0,0 +1,156 @@
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'SSIL'
+LOG_VERSION = 1
+
+# magic, version
+FILE_HEADER = struct.Struct('<4sB')
+# record kind and payload length
+RECORD = struct.Struct('<BI')
+# a server start, its settings as JSON; rooms start over after it
+SESSION = 0
+JOIN = 1
+TICK = 2
+# room, client id, spawn position
+JOIN_RECORD = struct.Struct('<IIii')
+# room, tick, timeStamp, random seed, state checksum after the tick,
+# inputs, lags, acks, expired clients
+TICK_HEADER = struct.Struct('<IIdQIHHHH')
+# owner, sequence, key mask, delta, timestamp; legacy clients send
+# unrounded deltas so nothing is quantized
+INPUT = struct.Struct('<IIBdd')
+LAG = struct.Struct('<Id')
+ACK = struct.Struct('<II')
+CLIENT = struct.Struct('<I')
+
+
+def newSeed():
+    return int.from_bytes(os.urandom(8), 'little')
+
+
+def stateChecksum(ships, bullets):
+    checksum = 0
+    for key, ship in ships.items():
+        checksum = zlib.crc32(struct.pack(
+            '<Iiidd?', key, ship.x, ship.y, ship.hitpoints, ship.direction,
+            ship.dead), checksum)
+    n = bullets.count
+    checksum = zlib.crc32(np.ascontiguousarray(bullets.x[:n]).tobytes(),
+                          checksum)
+    return zlib.crc32(np.ascontiguousarray(bullets.y[:n]).tobytes(),
+                      checksum)
+
+
+class InputLogWriter():
+    # append only: every room tick adds one record after it ran, joins are
+    # written as they happen between ticks
+    def __init__(self, path, settings):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(FILE_HEADER.pack(MAGIC, LOG_VERSION))
+        self.writeRecord(SESSION, json.dumps(settings).encode())
+        self.pending = None
+
+    def writeRecord(self, kind, payload):
+        self.file.write(RECORD.pack(kind, len(payload)))
+        self.file.write(payload)
+
+    def join(self, roomId, clientId, x, y):
+        self.writeRecord(JOIN, JOIN_RECORD.pack(roomId, clientId, x, y))
+
+    def beginTick(self, room, timeStamp, seed, inputs, lags, expired):
+        # packed before the tick runs, the acks and inputs are consumed by it
+        parts = []
+        inputCount = 0
+        for key, items in inputs.items():
+            for item in items:
+                parts.append(INPUT.pack(key, item['seq'], item['mask'],
+                                        item['delta'], item['timestamp']))
+                inputCount = inputCount + 1
+        for key, lag in lags.items():
+            parts.append(LAG.pack(key, lag))
+        for key, ack in room.acks.items():
+            parts.append(ACK.pack(key, ack))
+        for key in expired:
+            parts.append(CLIENT.pack(key))
+        self.pending = (room.roomId, room.tick + 1, timeStamp, seed,
+                        inputCount, len(lags), len(room.acks), len(expired),
+                        b''.join(parts))
+
+    def endTick(self, checksum):
+        (roomId, tick, timeStamp, seed, inputCount, lagCount, ackCount,
+         expiredCount, body) = self.pending
+        self.pending = None
+        header = TICK_HEADER.pack(roomId, tick, timeStamp, seed, checksum,
+                                  inputCount, lagCount, ackCount,
+                                  expiredCount)
+        self.writeRecord(TICK, header + body)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def readTick(payload):
+    (roomId, tick, timeStamp, seed, checksum, inputCount, lagCount,
+     ackCount, expiredCount) = TICK_HEADER.unpack_from(payload, 0)
+    offset = TICK_HEADER.size
+    inputs = {}
+    for i in range(inputCount):
+        key, seq, mask, delta, timestamp = INPUT.unpack_from(payload, offset)
+        offset = offset + INPUT.size
+        inputs.setdefault(key, []).append(
+            {'seq': seq, 'mask': mask, 'delta': delta,
+             'timestamp': timestamp})
+    lags = {}
+    for i in range(lagCount):
+        key, lag = LAG.unpack_from(payload, offset)
+        offset = offset + LAG.size
+        lags[key] = lag
+    acks = {}
+    for i in range(ackCount):
+        key, ack = ACK.unpack_from(payload, offset)
+        offset = offset + ACK.size
+        acks[key] = ack
+    expired = []
+    for i in range(expiredCount):
+        key, = CLIENT.unpack_from(payload, offset)
+        offset = offset + CLIENT.size
+        expired.append(key)
+    return {'room': roomId, 'tick': tick, 'timeStamp': timeStamp,
+            'seed': seed, 'checksum': checksum, 'inputs': inputs,
+            'lags': lags, 'acks': acks, 'expired': expired}
+
+
+def readLog(path):
+    # yields ('session', settings), ('join', ...) and ('tick', ...) records
+    # in the order they were written; a record cut short by a crash ends
+    # the log
+    with open(path, 'rb') as logFile:
+        header = logFile.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            raise ValueError('not an input log')
+        magic, version = FILE_HEADER.unpack(header)
+        if magic != MAGIC or version != LOG_VERSION:
+            raise ValueError('not an input log')
+        while True:
+            header = logFile.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            kind, length = RECORD.unpack(header)
+            payload = logFile.read(length)
+            if len(payload) < length:
+                return
+            if kind == SESSION:
+                yield 'session', json.loads(payload.decode())
+            elif kind == JOIN:
+                roomId, clientId, x, y = JOIN_RECORD.unpack(payload)
+                yield 'join', {'room': roomId, 'clientId': clientId,
+                               'x': x, 'y': y}
+            elif kind == TICK:
+                yield 'tick', readTick(payload)
@@ -0,0 +1,63 @@
+INPUT_RING_SIZE = 64
+
+
+class InputRing():
+    def __init__(self, capacity=INPUT_RING_SIZE):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.nextSeq = None
+        self.highestSeq = None
+        self.count = 0
+        self.received = 0
+        self.duplicates = 0
+        self.stale = 0
+        self.overflows = 0
+
+    def push(self, item):
+        self.received = self.received + 1
+        seq = item['seq']
+        if seq is None:
+            # legacy clients send no sequence numbers, number them here
+            seq = 0 if self.highestSeq is None else self.highestSeq + 1
+            item['seq'] = seq
+        if self.nextSeq is None or (self.count == 0 and
+                                    seq >= self.nextSeq + self.capacity):
+            # first input, or the client skipped ahead after lost packets
+            self.nextSeq = seq
+        if seq < self.nextSeq:
+            self.stale = self.stale + 1
+            return False
+        if seq >= self.nextSeq + self.capacity:
+            self.overflows = self.overflows + 1
+            return False
+        index = seq % self.capacity
+        if self.slots[index] is not None:
+            self.duplicates = self.duplicates + 1
+            return False
+        self.slots[index] = item
+        self.count = self.count + 1
+        if self.highestSeq is None or seq > self.highestSeq:
+            self.highestSeq = seq
+        return True
+
+    def drain(self):
+        if self.count == 0:
+            return []
+        items = []
+        slots = self.slots
+        for seq in range(self.nextSeq, self.highestSeq + 1):
+            index = seq % self.capacity
+            item = slots[index]
+            if item is not None:
+                items.append(item)
+                slots[index] = None
+        self.count = 0
+        self.nextSeq = self.highestSeq + 1
+        return items
+
+    def stats(self):
+        return {'received': self.received,
+                'buffered': self.count,
+                'duplicates': self.duplicates,
+                'stale': self.stale,
+                'overflows': self.overflows}
@@ -0,0 +1,92 @@
+from collections import deque
+
+INTERPOLATION_DELAY = 0.1
+MAX_EXTRAPOLATION = 0.25
+BUFFER_SIZE = 32
+# jumps longer than this are respawns and are not smoothed
+TELEPORT_DISTANCE = 200
+OFFSET_SMOOTHING = 0.1
+
+
+def lerp(a, b, alpha):
+    return a + (b - a) * alpha
+
+
+def blendShip(data, nextData, alpha):
+    if (abs(nextData['x'] - data['x']) > TELEPORT_DISTANCE
+            or abs(nextData['y'] - data['y']) > TELEPORT_DISTANCE):
+        return nextData if alpha >= 0.5 else data
+    blended = dict(data if alpha < 0.5 else nextData)
+    blended['x'] = int(round(lerp(data['x'], nextData['x'], alpha)))
+    blended['y'] = int(round(lerp(data['y'], nextData['y'], alpha)))
+    blended['direction'] = lerp(data['direction'], nextData['direction'],
+                                alpha)
+    return blended
+
+
+def blendBullet(record, nextRecord, alpha):
+    owner, bulletId, x, y, direction, age, bulletTime = record
+    return (owner, bulletId,
+            int(round(lerp(x, nextRecord[2], alpha))),
+            int(round(lerp(y, nextRecord[3], alpha))),
+            direction, lerp(age, nextRecord[5], alpha), bulletTime)
+
+
+class InterpolationBuffer():
+    def __init__(self, delay=INTERPOLATION_DELAY,
+                 maxExtrapolation=MAX_EXTRAPOLATION, size=BUFFER_SIZE):
+        self.delay = delay
+        self.maxExtrapolation = maxExtrapolation
+        self.snapshots = deque(maxlen=size)
+        self.offset = None
+
+    def push(self, timeStamp, ships, bullets, arrival):
+        # server clock minus ours, smoothed so jitter doesn't shake the view
+        offset = timeStamp - arrival
+        if self.offset is None:
+            self.offset = offset
+        else:
+            self.offset = lerp(self.offset, offset, OFFSET_SMOOTHING)
+        if len(self.snapshots) > 0 and timeStamp <= self.snapshots[-1][0]:
+            return
+        records = {}
+        for record in bullets:
+            records[(record[0], record[1])] = record
+        self.snapshots.append((timeStamp, ships, records))
+
+    def renderTime(self, now):
+        return now + self.offset - self.delay
+
+    def sample(self, now):
+        snapshots = self.snapshots
+        if len(snapshots) == 0:
+            return None
+        renderTime = self.renderTime(now)
+        if len(snapshots) == 1 or renderTime <= snapshots[0][0]:
+            timeStamp, ships, bullets = snapshots[0]
+            return ships, list(bullets.values())
+        for i in range(len(snapshots) - 1, 0, -1):
+            if snapshots[i - 1][0] <= renderTime:
+                break
+        older = snapshots[i - 1]
+        newer = snapshots[i]
+        span = newer[0] - older[0]
+        if renderTime > newer[0]:
+            # ran out of snapshots, keep moving along the last velocity
+            renderTime = min(renderTime, newer[0] + self.maxExtrapolation)
+        alpha = (renderTime - older[0]) / span
+        ships = {}
+        for key, data in newer[1].items():
+            oldData = older[1].get(key)
+            if oldData is None:
+                ships[key] = data
+            else:
+                ships[key] = blendShip(oldData, data, alpha)
+        bullets = []
+        for key, record in newer[2].items():
+            oldRecord = older[2].get(key)
+            if oldRecord is None:
+                bullets.append(record)
+            else:
+                bullets.append(blendBullet(oldRecord, record, alpha))
+        return ships, bullets
@@ -1,5 +1,6 @@
 #!/bin/python
 import asyncio
+import heapq
 import json
 import time
 
@@ -7,29 +8,80 @@ IP = '127.0.0.1'
 PORT = '8888'
 
 
-def serverEqual(server1, server2):
-    return (server1['ip'] == server2['ip']
-            and server1['port'] == server2['port'])
+SERVER_TTL = 30
+PAGE_SIZE = 50
 
 
-def serverInList(server, serverList):
-    for s in serverList:
-        if serverEqual(server, s):
-            return s
-    return False
+def serverKey(server):
+    return (server['ip'], server['port'], server.get('room'))
 
 
-def hearbeatFilter(server):
-    now = time.time()
-    if now - server['hearbeat'] > 30:
-        return False
-    else:
-        return True
+def freeSlots(server):
+    return server.get('maxPlayers', 16) - server.get('players', 0)
+
+
+def serverLoad(server):
+    players = server.get('players', 0) / max(server.get('maxPlayers', 16), 1)
+    return (players, server.get('tickP99', 0))
+
+
+class ServerRegistry():
+    def __init__(self, ttl=SERVER_TTL, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.servers = {}
+        self.expiries = []
+
+    def declare(self, information):
+        now = self.clock()
+        key = serverKey(information)
+        server = self.servers.get(key)
+        if server is None:
+            server = {}
+            self.servers[key] = server
+        server.update(information)
+        server.pop('type', None)
+        server['heartbeat'] = now
+        # refreshed servers leave their old heap entry behind; it is
+        # discarded when it reaches the top and the heartbeat is newer
+        heapq.heappush(self.expiries, (now + self.ttl, key))
+        return server
+
+    def expire(self):
+        now = self.clock()
+        expiries = self.expiries
+        while expiries and expiries[0][0] <= now:
+            deadline, key = heapq.heappop(expiries)
+            server = self.servers.get(key)
+            if server is not None and server['heartbeat'] + self.ttl <= now:
+                del self.servers[key]
+
+    def query(self, name=None, minFreeSlots=0, offset=0, limit=PAGE_SIZE,
+              order=None):
+        self.expire()
+        page = []
+        skipped = 0
+        servers = self.servers.values()
+        if order == 'load':
+            servers = sorted(servers, key=serverLoad)
+        for server in servers:
+            serverName = server['serverName'].lower()
+            if name is not None and name.lower() not in serverName:
+                continue
+            if freeSlots(server) < minFreeSlots:
+                continue
+            if skipped < offset:
+                skipped = skipped + 1
+                continue
+            page.append(server)
+            if len(page) >= limit:
+                break
+        return page
 
 
 class LookupServerProtocol(asyncio.Protocol):
-    def __init__(self, serverList):
-        self.serverList = serverList
+    def __init__(self, registry):
+        self.registry = registry
 
     def connection_made(self, transport):
         self.transport = transport
@@ -37,30 +89,49 @@ class LookupServerProtocol(asyncio.Protocol):
     def data_received(self, data):
         message = data.decode()
         information = json.loads(message)
-        for server in self.serverList:
-            if not hearbeatFilter(server):
-                self.serverList.remove(server)
+        self.registry.expire()
         if information['type'] == 'declaration':
-            if not serverInList(information, self.serverList):
-                information['hearbeat'] = time.time()
-                self.serverList.append(information)
-            else:
-                server = serverInList(information, self.serverList)
-                server['heartbeat'] = time.time()
+            self.registry.declare(information)
             replyData = {'code': 'ok'}
             self.transport.write(json.dumps(replyData).encode())
         elif information['type'] == 'query':
-            reply = json.dumps(self.serverList)
+            limit = min(int(information.get('limit', PAGE_SIZE)), PAGE_SIZE)
+            page = self.registry.query(information.get('name'),
+                                       int(information.get('freeSlots', 0)),
+                                       int(information.get('offset', 0)),
+                                       limit, information.get('order'))
+            reply = json.dumps(page)
             self.transport.write(reply.encode())
         self.transport.close()
 
 
+class LookupDatagramProtocol:
+    def __init__(self, registry):
+        self.registry = registry
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            information = json.loads(data.decode())
+            if information['type'] in ('heartbeat', 'declaration'):
+                self.registry.declare(information)
+                replyData = {'code': 'ok'}
+                self.transport.sendto(json.dumps(replyData).encode(), addr)
+        except (ValueError, KeyError):
+            pass
+
+
 async def main():
     loop = asyncio.get_running_loop()
-    serverList = []
+    registry = ServerRegistry()
     server = await loop.create_server(
-        lambda: LookupServerProtocol(serverList),
+        lambda: LookupServerProtocol(registry),
         IP, PORT)
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: LookupDatagramProtocol(registry),
+        local_addr=(IP, PORT))
     async with server:
         await server.serve_forever()
     pass
@@ -0,0 +1,68 @@
+import io
+import json
+import os
+import struct
+import pygame
+
+BUNDLE_NAME = 'sprites.bundle'
+# index length, then the JSON frame index, then the packed PNG
+BUNDLE_HEADER = struct.Struct('<I')
+PADDING = 1
+MAX_WIDTH = 256
+
+# directory, prefix the client loads the sprites by
+SOURCES = [
+    ('images', ''),
+    (os.path.join('..', 'assets'), 'assets/'),
+]
+
+
+def collectSprites(sources=SOURCES):
+    sprites = []
+    for directory, prefix in sources:
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.png'):
+                image = pygame.image.load(os.path.join(directory, filename))
+                sprites.append((prefix + filename, image))
+    return sprites
+
+
+def packShelves(sizes, maxWidth=MAX_WIDTH, padding=PADDING):
+    # tallest first, filling rows left to right
+    order = sorted(range(len(sizes)), key=lambda i: -sizes[i][1])
+    frames = [None] * len(sizes)
+    x = 0
+    y = 0
+    shelfHeight = 0
+    width = 0
+    for i in order:
+        w, h = sizes[i]
+        if x > 0 and x + w > maxWidth:
+            x = 0
+            y = y + shelfHeight + padding
+            shelfHeight = 0
+        frames[i] = (x, y, w, h)
+        x = x + w + padding
+        width = max(width, x - padding)
+        shelfHeight = max(shelfHeight, h)
+    return frames, (width, y + shelfHeight)
+
+
+def buildBundle(sprites):
+    frames, size = packShelves([image.get_size() for name, image in sprites])
+    atlas = pygame.Surface(size, pygame.SRCALPHA)
+    index = {'frames': {}}
+    for (name, image), frame in zip(sprites, frames):
+        atlas.blit(image, frame[:2])
+        index['frames'][name] = list(frame)
+    png = io.BytesIO()
+    pygame.image.save(atlas, png, 'atlas.png')
+    indexData = json.dumps(index).encode()
+    return BUNDLE_HEADER.pack(len(indexData)) + indexData + png.getvalue()
+
+
+if __name__ == '__main__':
+    bundle = buildBundle(collectSprites())
+    with open(os.path.join('images', BUNDLE_NAME), 'wb') as output:
+        output.write(bundle)
+    print('wrote {} bytes to {}'.format(len(bundle), BUNDLE_NAME))
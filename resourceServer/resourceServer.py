@@ -1,46 +1,174 @@
 import asyncio
+import hashlib
 import json
+import os
+import struct
+from collections import OrderedDict
 
 IP = '127.0.0.1'
 PORT = 8889
+ASSET_DIR = 'images'
+BUNDLE_SUFFIX = '.bundle'
 
+# every request is a length prefixed JSON object, every response a status
+# and body length followed by the body
+REQUEST_HEADER = struct.Struct('<I')
+RESPONSE_HEADER = struct.Struct('<HI')
+MAX_REQUEST = 4096
 
-class ResourceServerProtocol(asyncio.Protocol):
-    def connection_made(self, transport):
-        self.transport = transport
+OK = 200
+BAD_REQUEST = 400
+NOT_FOUND = 404
 
-    def data_received(self, data):
-        message = data.decode()
-        print(message)
-        information = json.loads(message)
-        try:
-            filename = 'images/' + information["filename"]
-            image = open(filename, 'rb')
-            replyData = image.read()
-            self.transport.write(replyData)
-            image.close()
-            self.transport.close()
-            print('done')
-        except FileNotFoundError:
-            messageData = {'status': 404}
-            self.transport.write(json.dumps(messageData).encode())
-        except json.JSONDecodeError:
-            messageData = {'status': 'illegal query'}
-            self.transport.write(json.dumps(messageData).encode())
+CACHE_SIZE = 32 * 1024 * 1024
+CACHE_ENTRY_SIZE = 4 * 1024 * 1024
 
 
+class AssetCache():
+    def __init__(self, maxBytes=CACHE_SIZE, maxEntry=CACHE_ENTRY_SIZE):
+        self.maxBytes = maxBytes
+        self.maxEntry = maxEntry
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
 
-async def main():
-    # Get a reference to the event loop as we plan to use
-    # low-level APIs.
+    def get(self, key):
+        data = self.entries.get(key)
+        if data is None:
+            self.misses = self.misses + 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits = self.hits + 1
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.maxEntry:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size = self.size - len(old)
+        self.entries[key] = data
+        self.size = self.size + len(data)
+        while self.size > self.maxBytes:
+            key, old = self.entries.popitem(last=False)
+            self.size = self.size - len(old)
+
+
+def buildManifest(directory=ASSET_DIR):
+    manifest = {}
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as asset:
+            data = asset.read()
+        manifest[filename] = {'hash': hashlib.sha256(data).hexdigest(),
+                              'size': len(data)}
+    return manifest
+
+
+class Assets():
+    def __init__(self, directory=ASSET_DIR, cache=None):
+        self.cache = cache if cache is not None else AssetCache()
+        self.manifest = buildManifest(directory)
+        self.manifestData = json.dumps(self.manifest).encode()
+        self.hashes = {}
+        for filename, entry in self.manifest.items():
+            self.hashes[entry['hash']] = filename
+
+    def resolve(self, information):
+        # assets are named by file name, manifest content hash or bundle
+        if 'hash' in information:
+            return self.hashes.get(information['hash'])
+        if 'bundle' in information:
+            return information['bundle'] + BUNDLE_SUFFIX
+        return information['filename']
+
+
+def assetPath(filename):
+    if not isinstance(filename, str) or filename in ('', '.', '..'):
+        return None
+    if os.path.basename(filename) != filename:
+        return None
+    return os.path.join(ASSET_DIR, filename)
+
+
+def writeStatus(writer, status):
+    writer.write(RESPONSE_HEADER.pack(status, 0))
+
+
+def writeBody(writer, data):
+    writer.write(RESPONSE_HEADER.pack(OK, len(data)))
+    writer.write(data)
+
+
+async def sendAsset(loop, writer, cache, filename):
+    path = assetPath(filename)
+    if path is None:
+        writeStatus(writer, BAD_REQUEST)
+        return
+    data = cache.get(path)
+    if data is not None:
+        writeBody(writer, data)
+        return
+    try:
+        asset = open(path, 'rb')
+    except (FileNotFoundError, IsADirectoryError):
+        writeStatus(writer, NOT_FOUND)
+        return
+    with asset:
+        size = os.fstat(asset.fileno()).st_size
+        writer.write(RESPONSE_HEADER.pack(OK, size))
+        if size <= cache.maxEntry:
+            data = asset.read(size)
+            cache.put(path, data)
+            writer.write(data)
+        else:
+            # too big to keep around, let the kernel copy it to the socket
+            await writer.drain()
+            await loop.sendfile(writer.transport, asset, 0, size)
+
+
+async def serveClient(reader, writer, assets):
     loop = asyncio.get_running_loop()
+    try:
+        while True:
+            header = await reader.readexactly(REQUEST_HEADER.size)
+            length, = REQUEST_HEADER.unpack(header)
+            if length > MAX_REQUEST:
+                writeStatus(writer, BAD_REQUEST)
+                break
+            message = await reader.readexactly(length)
+            try:
+                information = json.loads(message.decode())
+                manifest = information.get('manifest')
+                filename = None if manifest else assets.resolve(information)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                writeStatus(writer, BAD_REQUEST)
+                continue
+            if manifest:
+                writeBody(writer, assets.manifestData)
+            elif filename is None:
+                writeStatus(writer, NOT_FOUND)
+            else:
+                await sendAsset(loop, writer, assets.cache, filename)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
 
-    server = await loop.create_server(
-        lambda: ResourceServerProtocol(),
+
+async def main():
+    assets = Assets()
+    server = await asyncio.start_server(
+        lambda reader, writer: serveClient(reader, writer, assets),
         IP, PORT)
 
     async with server:
         await server.serve_forever()
 
 
-asyncio.run(main())
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,574 @@
+import math
+import time
+import random
+import numpy as np
+from inputCodec import KEY_W, KEY_A, KEY_S, KEY_D, KEY_SPACE
+
+# sizes of assets/ship.png and assets/bullet.png
+SHIP_SIZE = (41, 32)
+BULLET_SIZE = (6, 15)
+HISTORY_TICKS = 64
+
+# the server pins the clock for the length of a tick so every read inside
+# it agrees and a recorded tick replays exactly
+frozenTime = None
+
+
+def now():
+    if frozenTime is None:
+        return time.time()
+    return frozenTime
+
+
+def freezeTime(when):
+    global frozenTime
+    frozenTime = when
+
+
+def rectsCollide(ax, ay, aw, ah, bx, by, bw, bh):
+    if aw <= 0 or ah <= 0 or bw <= 0 or bh <= 0:
+        return False
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+
+class BarrierState():
+    __slots__ = ('x', 'y', 'w', 'h')
+
+    def __init__(self, beginpoint, size):
+        self.x, self.y = beginpoint
+        self.w, self.h = size
+
+    def collides(self, ship):
+        return rectsCollide(self.x, self.y, self.w, self.h,
+                            ship.x, ship.y, ship.w, ship.h)
+
+
+def sweepPositions(start, end, iterations, steps):
+    # accumulate the step sequentially like the scalar loop did so the
+    # truncated positions match it exactly, and stop once the end is passed
+    length = np.abs(end - start)
+    delta = np.where(start < end, length, -length) / np.where(
+        iterations > 0, iterations, 1)
+    positions = np.empty((len(start), steps))
+    positions[:, 0] = start
+    positions[:, 1:] = delta[:, None]
+    positions = np.add.accumulate(positions, axis=1)
+    end = end[:, None]
+    forward = (delta > 0)[:, None]
+    backward = (delta < 0)[:, None]
+    cap = np.where(positions >= end, positions, np.inf).min(axis=1)
+    positions = np.where(forward, np.minimum(positions, cap[:, None]),
+                         positions)
+    cap = np.where(positions <= end, positions, -np.inf).max(axis=1)
+    positions = np.where(backward, np.maximum(positions, cap[:, None]),
+                         positions)
+    return np.trunc(positions)
+
+
+class BulletPool():
+    ttl = 3
+    speed = 60
+
+    def __init__(self, capacity=64):
+        self.count = 0
+        self.owner = np.zeros(capacity, dtype=np.int64)
+        self.id = np.zeros(capacity, dtype=np.int64)
+        self.x = np.zeros(capacity, dtype=np.int64)
+        self.y = np.zeros(capacity, dtype=np.int64)
+        self.direction = np.zeros(capacity, dtype=np.float64)
+        self.age = np.zeros(capacity, dtype=np.float64)
+        self.time = np.zeros(capacity, dtype=np.float64)
+        # how far back in time the shooter saw the ships it aimed at
+        self.lag = np.zeros(capacity, dtype=np.float64)
+
+    def columns(self):
+        return (self.owner, self.id, self.x, self.y, self.direction,
+                self.age, self.time, self.lag)
+
+    def setColumns(self, columns):
+        (self.owner, self.id, self.x, self.y, self.direction, self.age,
+         self.time, self.lag) = columns
+
+    def reserve(self, capacity):
+        if capacity <= len(self.x):
+            return
+        size = max(capacity, len(self.x) * 2)
+        columns = []
+        for column in self.columns():
+            grown = np.zeros(size, dtype=column.dtype)
+            grown[:self.count] = column[:self.count]
+            columns.append(grown)
+        self.setColumns(columns)
+
+    def add(self, owner, bulletId, x, y, direction, age, bulletTime, lag=0):
+        self.reserve(self.count + 1)
+        i = self.count
+        self.owner[i] = owner
+        self.id[i] = bulletId
+        self.x[i] = x
+        self.y[i] = y
+        self.direction[i] = direction
+        self.age[i] = age
+        self.time[i] = bulletTime
+        self.lag[i] = lag
+        self.count = i + 1
+
+    def spawn(self, owner, bulletId, direction, x, y, lag=0):
+        if direction == 0:
+            direction = 360
+        spawnTime = now()
+        xSpeed = -math.sin(math.radians(direction)) * self.speed
+        ySpeed = -math.cos(math.radians(direction)) * self.speed
+        self.add(owner, bulletId, int(round(x)) + int(xSpeed),
+                 int(round(y)) + int(ySpeed), direction, 0, spawnTime, lag)
+
+    def spawnFired(self, ships, lags=None):
+        for key, ship in ships.items():
+            lag = 0 if lags is None else lags.get(key, 0)
+            for bulletId, direction, x, y in ship.gun.fired:
+                self.spawn(key, bulletId, direction, x, y, lag)
+            ship.gun.fired.clear()
+
+    def advance(self, when):
+        n = self.count
+        radians = np.radians(self.direction[:n])
+        xSpeed = np.trunc(-np.sin(radians) * self.speed)
+        ySpeed = np.trunc(-np.cos(radians) * self.speed)
+        self.x[:n] += xSpeed.astype(np.int64)
+        self.y[:n] += ySpeed.astype(np.int64)
+        self.age[:n] += when - self.time[:n]
+        self.time[:n] = when
+
+    def sweep(self, startX, startY, shipX, shipY, shipW, shipH,
+              pairs=None):
+        # same sub-steps as the per-bullet rect interpolation: one bullet
+        # sized box per bullet length between the old and new position
+        # ship positions are either one per ship or, for rewound tests, a
+        # row of them per bullet
+        w, h = BULLET_SIZE
+        n = self.count
+        iterations = np.maximum(np.abs(self.x[:n] - startX) / w,
+                                np.abs(self.y[:n] - startY) / h)
+        steps = int(iterations.max()) + 1
+        valid = np.arange(steps)[None, :] <= iterations[:, None]
+        x = sweepPositions(startX, self.x[:n], iterations, steps)
+        y = sweepPositions(startY, self.y[:n], iterations, steps)
+        if pairs is None:
+            x = x[:, :, None]
+            y = y[:, :, None]
+            if shipX.ndim == 2:
+                shipX = shipX[:, None, :]
+                shipY = shipY[:, None, :]
+            overlap = ((x < shipX + shipW) & (shipX < x + w)
+                       & (y < shipY + shipH) & (shipY < y + h))
+            overlap &= valid[:, :, None]
+            return overlap.any(axis=1)
+        bulletIndex, shipIndex = pairs
+        hits = np.zeros((n, len(shipW)), dtype=bool)
+        x = x[bulletIndex]
+        y = y[bulletIndex]
+        if shipX.ndim == 2:
+            shipX = shipX[bulletIndex, shipIndex][:, None]
+            shipY = shipY[bulletIndex, shipIndex][:, None]
+        else:
+            shipX = shipX[shipIndex][:, None]
+            shipY = shipY[shipIndex][:, None]
+        shipW = shipW[shipIndex][:, None]
+        shipH = shipH[shipIndex][:, None]
+        overlap = ((x < shipX + shipW) & (shipX < x + w)
+                   & (y < shipY + shipH) & (shipY < y + h))
+        overlap &= valid[bulletIndex]
+        hit = overlap.any(axis=1)
+        hits[bulletIndex[hit], shipIndex[hit]] = True
+        return hits
+
+    def sweptBounds(self, startX, startY):
+        w, h = BULLET_SIZE
+        n = self.count
+        return (np.minimum(startX, self.x[:n]),
+                np.minimum(startY, self.y[:n]),
+                np.maximum(startX, self.x[:n]) + w - 1,
+                np.maximum(startY, self.y[:n]) + h - 1)
+
+    def expire(self):
+        n = self.count
+        keep = self.age[:n] < self.ttl
+        self.compact(keep)
+
+    def removeOwner(self, owner):
+        n = self.count
+        self.compact(self.owner[:n] != owner)
+
+    def compact(self, keep):
+        kept = int(np.count_nonzero(keep))
+        if kept == self.count:
+            return
+        for column in self.columns():
+            column[:kept] = column[:self.count][keep]
+        self.count = kept
+
+    def copy(self):
+        bullets = BulletPool.__new__(BulletPool)
+        bullets.count = self.count
+        bullets.setColumns([column.copy() for column in self.columns()])
+        return bullets
+
+    def records(self):
+        n = self.count
+        return zip(self.owner[:n].tolist(), self.id[:n].tolist(),
+                   self.x[:n].tolist(), self.y[:n].tolist(),
+                   self.direction[:n].tolist(), self.age[:n].tolist(),
+                   self.time[:n].tolist())
+
+    def fromRecords(records):
+        bullets = BulletPool(max(len(records), 1))
+        for record in records:
+            bullets.add(*record)
+        return bullets
+
+
+class GunState():
+    __slots__ = ('lastTimeFired', 'interval', 'fired', 'nextBulletId')
+
+    def __init__(self):
+        self.lastTimeFired = 0
+        self.interval = 0.2
+        self.fired = []
+        self.nextBulletId = 1
+
+    def shoot(self, direction, x, y):
+        if now() - self.lastTimeFired > self.interval:
+            self.fired.append((self.nextBulletId, direction, x, y))
+            self.nextBulletId = self.nextBulletId + 1
+            self.lastTimeFired = now()
+
+    def copy(self):
+        gun = GunState.__new__(GunState)
+        gun.lastTimeFired = self.lastTimeFired
+        gun.interval = self.interval
+        gun.fired = list(self.fired)
+        gun.nextBulletId = self.nextBulletId
+        return gun
+
+    def jsonSerialize(self):
+        data = {'lastTimeFired': self.lastTimeFired,
+                'nextBulletId': self.nextBulletId}
+        return data
+
+    def readJson(self, data):
+        self.lastTimeFired = data['lastTimeFired']
+        self.nextBulletId = data.get('nextBulletId', 1)
+
+    def jsonDeserialize(data):
+        gun = GunState()
+        gun.readJson(data)
+        return gun
+
+
+class ShipState():
+    __slots__ = ('x', 'y', 'w', 'h', 'velocity', 'direction', 'colliding',
+                 'hitpoints', 'dead', 'gun', 'deadStamp')
+    respawnTimer = 5
+
+    def __init__(self, x, y, hitpoints=10):
+        self.x = x
+        self.y = y
+        self.w, self.h = SHIP_SIZE
+        self.velocity = 0
+        self.direction = 360
+        self.colliding = False
+        self.hitpoints = hitpoints
+        self.dead = False
+        self.gun = GunState()
+        self.deadStamp = 0
+
+    def move(self, xSpeed, ySpeed):
+        self.x = self.x + int(xSpeed)
+        self.y = self.y + int(ySpeed)
+
+    def collides(self, x, y, w, h):
+        return rectsCollide(self.x, self.y, self.w, self.h, x, y, w, h)
+
+    def update(self, ships):
+        self.handleInterShipCollision(ships)
+        self.handleDeath()
+        xSpeed = -math.sin(math.radians(self.direction)) * self.velocity
+        ySpeed = -math.cos(math.radians(self.direction)) * self.velocity
+        self.move(round(xSpeed, 0), round(ySpeed, 0))
+
+    def takeDamage(self, damage):
+        if self.hitpoints > 0:
+            self.hitpoints = self.hitpoints - damage
+            if self.hitpoints < 0:
+                self.hitpoints = 0
+
+    def handleDeath(self):
+        if self.hitpoints <= 0:
+            if self.deadStamp == 0:
+                self.deadStamp = now()
+            self.dead = True
+
+    def spawn(self):
+        if self.dead and now() - self.deadStamp > self.respawnTimer:
+            self.x = random.randint(0, 400)
+            self.y = random.randint(0, 400)
+            self.dead = False
+            self.deadStamp = 0
+            self.velocity = 0
+            self.hitpoints = 10
+            self.colliding = False
+
+    def handleInterShipCollision(self, ships):
+        collision = False
+        for ship in ships:
+            if self.collides(ship.x, ship.y, ship.w, ship.h):
+                collision = True
+                if not self.colliding and not ship.colliding:
+                    self.colliding = True
+                    ship.colliding = True
+                    self.takeDamage(1)
+                    ship.takeDamage(1)
+                    oldVelocity = self.velocity
+                    oldDir = self.direction
+                    self.direction = ship.direction
+                    self.velocity = ship.velocity
+                    ship.direction = oldDir
+                    ship.velocity = oldVelocity
+                    xSpeed = - \
+                        math.sin(math.radians(self.direction)) * self.velocity
+                    ySpeed = - \
+                        math.cos(math.radians(self.direction)) * self.velocity
+                    self.move(round(xSpeed, 0), round(ySpeed, 0))
+                    xSpeed = - \
+                        math.sin(math.radians(ship.direction)) * ship.velocity
+                    ySpeed = - \
+                        math.cos(math.radians(ship.direction)) * ship.velocity
+                    ship.move(round(xSpeed, 0), round(ySpeed, 0))
+        return collision
+
+    def handleMovementInput(self, mask, deltaTime, ships):
+        maxVelocity = 15
+        if self.dead:
+            return
+        if mask & KEY_W:
+            self.velocity = 5 * deltaTime + self.velocity
+            if self.velocity > maxVelocity:
+                self.velocity = maxVelocity
+        elif mask & KEY_S:
+            self.velocity = self.velocity - 20 * deltaTime
+            if self.velocity < 0:
+                self.velocity = 0
+        if mask & KEY_A:
+            self.direction = self.direction + 180 * deltaTime
+        elif mask & KEY_D:
+            self.direction = self.direction - 180 * deltaTime
+        if mask & KEY_SPACE:
+            x, y = self.getCenter()
+            x = x - math.sin(math.radians(self.direction)) * self.velocity
+            y = y - math.cos(math.radians(self.direction)) * self.velocity
+            self.gun.shoot(self.getDirection(), x, y)
+        self.update(ships)
+
+    def isSame(self, ship):
+        return self.x == ship.x and self.y == ship.y
+
+    def copyState(self, ship):
+        self.x = ship.x
+        self.y = ship.y
+        self.w = ship.w
+        self.h = ship.h
+        self.velocity = ship.velocity
+        self.direction = ship.direction
+        self.colliding = ship.colliding
+        self.hitpoints = ship.hitpoints
+        self.dead = ship.dead
+        self.gun = ship.gun.copy()
+        self.deadStamp = ship.deadStamp
+
+    def copy(self):
+        ship = ShipState.__new__(ShipState)
+        ship.copyState(self)
+        return ship
+
+    def jsonSerialize(self):
+        data = {"x": self.x,
+                "y": self.y,
+                "h": self.h,
+                "w": self.w,
+                "velocity": self.velocity,
+                "hitpoints": self.hitpoints,
+                "colliding": self.colliding,
+                "dead": self.dead,
+                "deadStamp": self.deadStamp,
+                "gun": self.gun.jsonSerialize(),
+                "direction": self.direction
+                }
+        return data
+
+    def readJson(self, data):
+        self.x = data["x"]
+        self.y = data["y"]
+        self.hitpoints = data['hitpoints']
+        self.velocity = data['velocity']
+        self.colliding = data['colliding']
+        self.dead = data['dead']
+        self.deadStamp = data['deadStamp']
+        self.gun.readJson(data['gun'])
+        self.direction = data['direction']
+        self.handleDeath()
+
+    def jsonDeserialize(data):
+        ship = ShipState(data["x"], data["y"])
+        ship.readJson(data)
+        return ship
+
+    def getDirection(self):
+        return self.direction
+
+    def getCenter(self):
+        x = self.x + self.w/2
+        y = self.y + self.h/2
+        return x, y
+
+
+class PositionHistory():
+    # ring of past ship positions, one row per tick and one column per
+    # ship; recording only writes into the preallocated arrays
+    def __init__(self, capacity=HISTORY_TICKS, slots=16):
+        self.capacity = capacity
+        self.times = np.full(capacity, -np.inf)
+        self.x = np.zeros((capacity, slots), dtype=np.int64)
+        self.y = np.zeros((capacity, slots), dtype=np.int64)
+        self.present = np.zeros((capacity, slots), dtype=bool)
+        self.slots = {}
+        self.free = list(range(slots - 1, -1, -1))
+        self.head = 0
+
+    def grow(self):
+        slots = self.x.shape[1]
+        for name in ('x', 'y', 'present'):
+            column = getattr(self, name)
+            grown = np.zeros((self.capacity, slots * 2), dtype=column.dtype)
+            grown[:, :slots] = column
+            setattr(self, name, grown)
+        self.free = list(range(slots * 2 - 1, slots - 1, -1))
+
+    def slotFor(self, key):
+        slot = self.slots.get(key)
+        if slot is None:
+            if len(self.free) == 0:
+                self.grow()
+            slot = self.free.pop()
+            self.present[:, slot] = False
+            self.slots[key] = slot
+        return slot
+
+    def release(self, key):
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self.free.append(slot)
+
+    def record(self, when, ships):
+        row = (self.head + 1) % self.capacity
+        self.head = row
+        self.times[row] = when
+        self.present[row] = False
+        for key, ship in ships.items():
+            slot = self.slotFor(key)
+            self.x[row, slot] = ship.x
+            self.y[row, slot] = ship.y
+            self.present[row, slot] = True
+
+    def rowsAt(self, when):
+        # for every time in when the newest row recorded at or before it,
+        # or the oldest row left; lags snap to whole ticks this way
+        order = np.argsort(self.times, kind='stable')
+        ordered = self.times[order]
+        empty = int(np.count_nonzero(ordered == -np.inf))
+        index = np.searchsorted(ordered, when, side='right') - 1
+        return order[np.clip(index, empty, self.capacity - 1)]
+
+    def rewind(self, rows, keys, shipX, shipY):
+        # positions of keys in each of rows, one result row per entry;
+        # ships missing from a row stay where they are now
+        slots = np.array([self.slots.get(key, -1) for key in keys],
+                         dtype=np.int64)
+        known = slots >= 0
+        slots = np.where(known, slots, 0)
+        rows = rows[:, None]
+        present = self.present[rows, slots] & known
+        return (np.where(present, self.x[rows, slots], shipX),
+                np.where(present, self.y[rows, slots], shipY))
+
+
+def handleBullets(ships, bullets, grid=None, history=None, lags=None):
+    bullets.spawnFired(ships, lags)
+    n = bullets.count
+    if n == 0:
+        return
+    startX = bullets.x[:n].copy()
+    startY = bullets.y[:n].copy()
+    bullets.advance(now())
+    if len(ships) > 0:
+        keys = list(ships.keys())
+        shipList = list(ships.values())
+        shipX = np.array([ship.x for ship in shipList])
+        shipY = np.array([ship.y for ship in shipList])
+        shipW = np.array([ship.w for ship in shipList])
+        shipH = np.array([ship.h for ship in shipList])
+        pairs = None
+        reach = 0
+        lag = bullets.lag[:n]
+        lagged = lag > 0
+        if history is not None and lagged.any():
+            # every bullet is tested against the ships where its shooter
+            # saw them, so ship positions become one row per bullet
+            rewoundX, rewoundY = history.rewind(
+                history.rowsAt(now() - lag), keys, shipX, shipY)
+            # the shooter is tested where it is now, as without lag, or a
+            # bullet could run into where its own ship used to be
+            lagged = lagged[:, None] & (
+                bullets.owner[:n][:, None] != np.array(keys)[None, :])
+            rewoundX = np.where(lagged, rewoundX, shipX)
+            rewoundY = np.where(lagged, rewoundY, shipY)
+            reach = np.maximum(np.abs(rewoundX - shipX).max(axis=1),
+                               np.abs(rewoundY - shipY).max(axis=1))
+            shipX = rewoundX
+            shipY = rewoundY
+        if grid is not None:
+            # the grid holds ships where they are now, so widen every box
+            # by the furthest a ship was rewound for that bullet
+            minX, minY, maxX, maxY = bullets.sweptBounds(startX, startY)
+            bulletIndex, pairKeys = grid.candidatePairs(
+                minX - reach, minY - reach, maxX + reach, maxY + reach)
+            keyArray = np.array(keys, dtype=np.int64)
+            keyOrder = np.argsort(keyArray)
+            shipIndex = keyOrder[np.searchsorted(
+                keyArray[keyOrder], pairKeys)]
+            pairs = (bulletIndex, shipIndex)
+        hits = bullets.sweep(startX, startY, shipX, shipY, shipW, shipH,
+                             pairs)
+        damage = hits.sum(axis=0)
+        for ship, count in zip(shipList, damage.tolist()):
+            if count > 0:
+                ship.takeDamage(count)
+        bullets.age[:n][hits.any(axis=1)] = 1000
+    bullets.expire()
+
+
+def handleBarriers(ships, barriers, grid=None):
+    for barrier in barriers:
+        if grid is None:
+            candidates = ships.values()
+        else:
+            keys = grid.query(barrier.x, barrier.y, barrier.w, barrier.h)
+            candidates = [ships[key] for key in keys]
+        for ship in candidates:
+            if barrier.collides(ship):
+                ship.takeDamage(2)
+                ship.direction = ship.direction + 180
+
+
+def handleRespawns(ships):
+    for value in ships.values():
+        value.spawn()
@@ -0,0 +1,413 @@
+import math
+import struct
+from collections import deque
+
+SNAPSHOT_VERSION = 5
+
+FLAG_HANDSHAKE = 1
+FLAG_SUMMARY = 2
+
+SHIP_COLLIDING = 1
+SHIP_DEAD = 2
+
+HISTORY_SIZE = 64
+
+# entities are culled per client by the coarse cell they sit in: a client
+# gets every cell within the radius of its own, counted in whole cells on
+# each axis. None turns culling off so every client shares one encoding
+INTEREST_RADIUS = None
+INTEREST_CELL = 256
+# every this many ticks clients also get the position of every ship
+# outside their area of interest
+SUMMARY_INTERVAL = 20
+
+# version, flags, tick, baseTick, timeStamp, clientId, changed ships,
+# removed ships, changed bullets, removed bullets, summary ships
+HEADER = struct.Struct('<BBIIdIHHHHH')
+CLIENT_ID = struct.Struct('<I')
+CLIENT_ID_OFFSET = 18
+# x, y, w, h, velocity, direction, hitpoints, flags, deadStamp,
+# lastTimeFired
+SHIP_FIELDS = 'iiHHddbBdd'
+# x, y, direction, age, time
+BULLET_FIELDS = 'iiddd'
+# the recipient's authoritative ship: id, last input sequence the server
+# applied to it, then every ship field
+OWN_SHIP = struct.Struct('<II' + SHIP_FIELDS)
+# id, changed field mask
+SHIP_DELTA = struct.Struct('<IH')
+# owner, bullet id, changed field mask
+BULLET_DELTA = struct.Struct('<IIB')
+SHIP_ID = struct.Struct('<I')
+BULLET_ID = struct.Struct('<II')
+# id, x, y of a ship outside the area of interest
+SUMMARY = struct.Struct('<Ihh')
+
+EMPTY_STATE = ({}, {})
+
+fieldStructs = {}
+
+
+def fieldStruct(fields, mask):
+    key = (fields, mask)
+    packer = fieldStructs.get(key)
+    if packer is None:
+        layout = '<'
+        for i, field in enumerate(fields):
+            if mask & (1 << i):
+                layout = layout + field
+        packer = struct.Struct(layout)
+        fieldStructs[key] = packer
+    return packer
+
+
+def changedFields(values, baseValues):
+    if baseValues is None:
+        return (1 << len(values)) - 1, values
+    mask = 0
+    changed = []
+    for i, value in enumerate(values):
+        if value != baseValues[i]:
+            mask = mask | (1 << i)
+            changed.append(value)
+    return mask, changed
+
+
+def applyFields(baseValues, mask, changed):
+    if baseValues is None:
+        return tuple(changed)
+    values = list(baseValues)
+    j = 0
+    for i in range(len(values)):
+        if mask & (1 << i):
+            values[i] = changed[j]
+            j = j + 1
+    return tuple(values)
+
+
+def isSnapshot(data):
+    return len(data) >= HEADER.size and data[0] == SNAPSHOT_VERSION
+
+
+def shipFields(ship):
+    flags = 0
+    if ship.colliding:
+        flags = flags | SHIP_COLLIDING
+    if ship.dead:
+        flags = flags | SHIP_DEAD
+    return (ship.x, ship.y, ship.w, ship.h,
+            ship.velocity, ship.direction, ship.hitpoints, flags,
+            ship.deadStamp, ship.gun.lastTimeFired)
+
+
+def captureState(ships, bullets):
+    shipState = {}
+    bulletState = {}
+    for key, ship in ships.items():
+        shipState[key] = shipFields(ship)
+    for owner, bulletId, x, y, direction, age, bulletTime in bullets.records():
+        bulletState[(owner, bulletId)] = (x, y, direction, age, bulletTime)
+    return shipState, bulletState
+
+
+class SnapshotBuffer():
+    def __init__(self):
+        self.buffer = bytearray(HEADER.size + OWN_SHIP.size)
+        self.size = len(self.buffer)
+
+    def encode(self, state, baseline, tick=0, baseTick=0,
+               timeStamp=0.0, clientId=0, flags=0, summary=None):
+        shipState, bulletState = state
+        baseShips, baseBullets = baseline
+        size = HEADER.size + OWN_SHIP.size
+        shipDeltas = []
+        for key, values in shipState.items():
+            mask, changed = changedFields(values, baseShips.get(key))
+            if mask:
+                packer = fieldStruct(SHIP_FIELDS, mask)
+                shipDeltas.append((key, mask, packer, changed))
+                size = size + SHIP_DELTA.size + packer.size
+        removedShips = [key for key in baseShips if key not in shipState]
+        size = size + SHIP_ID.size * len(removedShips)
+        bulletDeltas = []
+        for key, values in bulletState.items():
+            mask, changed = changedFields(values, baseBullets.get(key))
+            if mask:
+                packer = fieldStruct(BULLET_FIELDS, mask)
+                bulletDeltas.append((key, mask, packer, changed))
+                size = size + BULLET_DELTA.size + packer.size
+        removedBullets = [key for key in baseBullets
+                          if key not in bulletState]
+        size = size + BULLET_ID.size * len(removedBullets)
+        if summary is not None:
+            flags = flags | FLAG_SUMMARY
+            size = size + SUMMARY.size * len(summary)
+        else:
+            summary = ()
+        if len(self.buffer) < size:
+            self.buffer = bytearray(size * 2)
+        self.size = size
+        buffer = self.buffer
+        HEADER.pack_into(buffer, 0, SNAPSHOT_VERSION, flags, tick, baseTick,
+                         timeStamp, clientId, len(shipDeltas),
+                         len(removedShips), len(bulletDeltas),
+                         len(removedBullets), len(summary))
+        offset = HEADER.size + OWN_SHIP.size
+        for key, mask, packer, changed in shipDeltas:
+            SHIP_DELTA.pack_into(buffer, offset, key, mask)
+            offset = offset + SHIP_DELTA.size
+            packer.pack_into(buffer, offset, *changed)
+            offset = offset + packer.size
+        for key in removedShips:
+            SHIP_ID.pack_into(buffer, offset, key)
+            offset = offset + SHIP_ID.size
+        for (owner, bulletId), mask, packer, changed in bulletDeltas:
+            BULLET_DELTA.pack_into(buffer, offset, owner, bulletId, mask)
+            offset = offset + BULLET_DELTA.size
+            packer.pack_into(buffer, offset, *changed)
+            offset = offset + packer.size
+        for owner, bulletId in removedBullets:
+            BULLET_ID.pack_into(buffer, offset, owner, bulletId)
+            offset = offset + BULLET_ID.size
+        for key, x, y in summary:
+            SUMMARY.pack_into(buffer, offset, key, x, y)
+            offset = offset + SUMMARY.size
+        return self.view()
+
+    def patch(self, clientId, ship, lastSeq=0):
+        CLIENT_ID.pack_into(self.buffer, CLIENT_ID_OFFSET, clientId)
+        OWN_SHIP.pack_into(self.buffer, HEADER.size, clientId, lastSeq,
+                           *shipFields(ship))
+
+    def view(self):
+        return memoryview(self.buffer)[:self.size]
+
+
+def cellOf(x, y, cellSize):
+    return (int(x) // cellSize, int(y) // cellSize)
+
+
+def clampPosition(value):
+    return max(-32768, min(32767, int(value)))
+
+
+class SnapshotEncoder():
+    def __init__(self, historySize=HISTORY_SIZE,
+                 interestRadius=INTEREST_RADIUS, cellSize=INTEREST_CELL,
+                 summaryInterval=SUMMARY_INTERVAL, worldSize=None):
+        self.historySize = historySize
+        self.cellSize = cellSize
+        self.reach = None
+        if interestRadius is not None:
+            self.reach = math.ceil(interestRadius / cellSize)
+            if worldSize is not None and self.reach >= math.ceil(
+                    max(worldSize) / cellSize):
+                # every cell sees the whole world, culling only splits up
+                # the shared encoding
+                self.reach = None
+        self.summaryInterval = summaryInterval
+        self.history = {}
+        self.views = {}
+        self.sentCells = {}
+        self.ticks = deque()
+        self.buffers = []
+        self.encoded = {}
+        self.state = EMPTY_STATE
+        self.tick = 0
+        self.timeStamp = 0.0
+
+    def capture(self, tick, timeStamp, ships, bullets):
+        self.state = captureState(ships, bullets)
+        self.tick = tick
+        self.timeStamp = timeStamp
+        self.encoded.clear()
+        self.history[tick] = self.state
+        self.views[tick] = {}
+        self.ticks.append(tick)
+        while len(self.ticks) > self.historySize:
+            oldTick = self.ticks.popleft()
+            del self.history[oldTick]
+            del self.views[oldTick]
+
+    def cellFor(self, ship):
+        if self.reach is None:
+            return None
+        return cellOf(ship.x, ship.y, self.cellSize)
+
+    def view(self, tick, cell):
+        # the part of a captured tick a client centred on cell receives
+        if cell is None:
+            return self.history[tick]
+        views = self.views[tick]
+        state = views.get(cell)
+        if state is None:
+            shipState, bulletState = self.history[tick]
+            state = ({}, {})
+            for key, values in shipState.items():
+                if self.isVisible(values[0], values[1], cell):
+                    state[0][key] = values
+            for key, values in bulletState.items():
+                if self.isVisible(values[0], values[1], cell):
+                    state[1][key] = values
+            views[cell] = state
+        return state
+
+    def isVisible(self, x, y, cell):
+        cx, cy = cellOf(x, y, self.cellSize)
+        return (abs(cx - cell[0]) <= self.reach
+                and abs(cy - cell[1]) <= self.reach)
+
+    def summary(self, cell):
+        if cell is None or self.tick % self.summaryInterval != 0:
+            return None
+        visible = self.view(self.tick, cell)[0]
+        summary = []
+        for key, values in self.state[0].items():
+            if key not in visible:
+                summary.append((key, clampPosition(values[0]),
+                                clampPosition(values[1])))
+        return summary
+
+    def encodeFor(self, clientId, ship, ackTick, lastSeq=0):
+        cell = self.cellFor(ship)
+        sentCells = self.sentCells.get(clientId)
+        if sentCells is None:
+            sentCells = {}
+            self.sentCells[clientId] = sentCells
+        baseCell = sentCells.get(ackTick)
+        if (ackTick not in self.history or ackTick == self.tick
+                or ackTick not in sentCells):
+            baseTick = 0
+            baseCell = None
+            baseline = EMPTY_STATE
+        else:
+            baseTick = ackTick
+            baseline = self.view(ackTick, baseCell)
+        # clients share an encoding when they see the same area and
+        # acknowledged the same view
+        key = (baseTick, baseCell, cell)
+        buffer = self.encoded.get(key)
+        if buffer is None:
+            if len(self.buffers) <= len(self.encoded):
+                self.buffers.append(SnapshotBuffer())
+            buffer = self.buffers[len(self.encoded)]
+            buffer.encode(self.view(self.tick, cell), baseline,
+                          self.tick, baseTick, self.timeStamp,
+                          summary=self.summary(cell))
+            self.encoded[key] = buffer
+        buffer.patch(clientId, ship, lastSeq)
+        sentCells[self.tick] = cell
+        while len(sentCells) > self.historySize:
+            del sentCells[next(iter(sentCells))]
+        return buffer.view()
+
+    def forget(self, clientId):
+        self.sentCells.pop(clientId, None)
+
+
+def encodeSnapshot(ships, bullets, tick=0, timeStamp=0.0, clientId=0,
+                   flags=0):
+    buffer = SnapshotBuffer()
+    buffer.encode(captureState(ships, bullets), EMPTY_STATE, tick, 0,
+                  timeStamp, clientId, flags)
+    buffer.patch(clientId, ships[clientId])
+    return bytes(buffer.view())
+
+
+def shipData(values):
+    (x, y, w, h, velocity, direction, hitpoints, flags, deadStamp,
+     lastTimeFired) = values
+    return {"x": x,
+            "y": y,
+            "h": h,
+            "w": w,
+            "velocity": velocity,
+            "hitpoints": hitpoints,
+            "colliding": bool(flags & SHIP_COLLIDING),
+            "dead": bool(flags & SHIP_DEAD),
+            "deadStamp": deadStamp,
+            "gun": {'lastTimeFired': lastTimeFired},
+            "direction": direction
+            }
+
+
+class SnapshotDecoder():
+    def __init__(self, historySize=HISTORY_SIZE):
+        self.historySize = historySize
+        self.history = {}
+        self.ticks = deque()
+        self.lastTick = 0
+
+    def decode(self, data):
+        (version, flags, tick, baseTick, timeStamp, clientId, shipCount,
+         removedShipCount, bulletCount, removedBulletCount,
+         summaryCount) = HEADER.unpack_from(data, 0)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError('malformed snapshot')
+        handshake = bool(flags & FLAG_HANDSHAKE)
+        if not handshake and tick <= self.lastTick:
+            return None
+        if baseTick == 0:
+            baseline = EMPTY_STATE
+        elif baseTick in self.history:
+            baseline = self.history[baseTick]
+        else:
+            return None
+        baseShips, baseBullets = baseline
+        shipState = dict(baseShips)
+        bulletState = dict(baseBullets)
+        ownShip = OWN_SHIP.unpack_from(data, HEADER.size)
+        offset = HEADER.size + OWN_SHIP.size
+        for i in range(shipCount):
+            key, mask = SHIP_DELTA.unpack_from(data, offset)
+            offset = offset + SHIP_DELTA.size
+            packer = fieldStruct(SHIP_FIELDS, mask)
+            changed = packer.unpack_from(data, offset)
+            offset = offset + packer.size
+            shipState[key] = applyFields(shipState.get(key), mask, changed)
+        for i in range(removedShipCount):
+            key, = SHIP_ID.unpack_from(data, offset)
+            offset = offset + SHIP_ID.size
+            shipState.pop(key, None)
+        for i in range(bulletCount):
+            owner, bulletId, mask = BULLET_DELTA.unpack_from(data, offset)
+            offset = offset + BULLET_DELTA.size
+            packer = fieldStruct(BULLET_FIELDS, mask)
+            changed = packer.unpack_from(data, offset)
+            offset = offset + packer.size
+            key = (owner, bulletId)
+            bulletState[key] = applyFields(
+                bulletState.get(key), mask, changed)
+        for i in range(removedBulletCount):
+            key = BULLET_ID.unpack_from(data, offset)
+            offset = offset + BULLET_ID.size
+            bulletState.pop(key, None)
+        summary = None
+        if flags & FLAG_SUMMARY:
+            summaryEnd = offset + SUMMARY.size * summaryCount
+            if len(data) < summaryEnd:
+                raise ValueError('malformed snapshot')
+            summary = list(SUMMARY.iter_unpack(
+                memoryview(data)[offset:summaryEnd]))
+        if not handshake:
+            self.lastTick = tick
+            self.history[tick] = (shipState, bulletState)
+            self.ticks.append(tick)
+            while len(self.ticks) > self.historySize:
+                del self.history[self.ticks.popleft()]
+        bullets = []
+        for (owner, bulletId), values in bulletState.items():
+            bullets.append((owner, bulletId) + values)
+        ships = {}
+        for key, values in shipState.items():
+            ships[key] = shipData(values)
+        if clientId in ships:
+            ships[clientId] = shipData(ownShip[2:])
+        return {'handshake': int(handshake),
+                'tick': tick,
+                'lastSeq': ownShip[1],
+                'timeStamp': timeStamp,
+                'clientId': clientId,
+                'ships': ships,
+                'bullets': bullets,
+                'summary': summary}
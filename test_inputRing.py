@@ -0,0 +1,76 @@
+import unittest
+
+from inputRing import InputRing
+
+
+def item(seq):
+    return {'seq': seq, 'mask': 0, 'delta': 0.016, 'timestamp': 0.0}
+
+
+def seqs(items):
+    return [value['seq'] for value in items]
+
+
+class InputRingTest(unittest.TestCase):
+    def testDrainsInSequenceOrder(self):
+        ring = InputRing(8)
+        for seq in (5, 7, 6):
+            self.assertTrue(ring.push(item(seq)))
+        self.assertEqual(seqs(ring.drain()), [5, 6, 7])
+        self.assertEqual(ring.drain(), [])
+        self.assertTrue(ring.push(item(8)))
+        self.assertEqual(seqs(ring.drain()), [8])
+
+    def testDuplicates(self):
+        ring = InputRing(8)
+        ring.push(item(1))
+        ring.push(item(2))
+        self.assertFalse(ring.push(item(2)))
+        self.assertEqual(seqs(ring.drain()), [1, 2])
+        self.assertEqual(ring.stats()['duplicates'], 1)
+
+    def testStale(self):
+        ring = InputRing(8)
+        ring.push(item(3))
+        ring.drain()
+        # resent inputs the last tick already applied
+        self.assertFalse(ring.push(item(3)))
+        self.assertFalse(ring.push(item(1)))
+        self.assertTrue(ring.push(item(4)))
+        self.assertEqual(ring.stats()['stale'], 2)
+
+    def testOverflow(self):
+        ring = InputRing(4)
+        for seq in range(4):
+            self.assertTrue(ring.push(item(seq)))
+        self.assertFalse(ring.push(item(4)))
+        self.assertEqual(ring.stats()['overflows'], 1)
+        self.assertEqual(ring.stats()['buffered'], 4)
+        self.assertEqual(seqs(ring.drain()), [0, 1, 2, 3])
+        self.assertTrue(ring.push(item(4)))
+
+    def testJumpAheadAfterLoss(self):
+        ring = InputRing(4)
+        ring.push(item(0))
+        ring.drain()
+        # everything in between was lost, an empty ring follows the client
+        self.assertTrue(ring.push(item(100)))
+        self.assertTrue(ring.push(item(101)))
+        self.assertEqual(seqs(ring.drain()), [100, 101])
+        self.assertFalse(ring.push(item(50)))
+        self.assertEqual(ring.stats()['overflows'], 0)
+
+    def testLegacyInputsAreNumbered(self):
+        ring = InputRing(8)
+        for i in range(3):
+            self.assertTrue(ring.push(item(None)))
+        self.assertEqual(seqs(ring.drain()), [0, 1, 2])
+        self.assertTrue(ring.push(item(None)))
+        self.assertEqual(seqs(ring.drain()), [3])
+        stats = ring.stats()
+        self.assertEqual(stats['received'], 4)
+        self.assertEqual(stats['duplicates'] + stats['stale'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+import random
+import unittest
+
+import numpy as np
+
+from broadphase import SpatialHash
+from gameServer import createBarriers, formTimeLineData, simulateMovements
+from gameServer import WORLD_SIZE
+from inputCodec import KEY_W, KEY_A, KEY_D, KEY_S, KEY_SPACE
+from simulation import ShipState, BulletPool, PositionHistory
+from simulation import handleBullets, handleBarriers, freezeTime
+from simulation import sweepPositions, rectsCollide, BULLET_SIZE
+from simulation import HISTORY_TICKS
+
+MASKS = (KEY_W, KEY_A, KEY_D, KEY_S, KEY_W | KEY_A, KEY_W | KEY_SPACE)
+
+
+def interpolate(startX, startY, endX, endY):
+    # the per bullet rect interpolation the pool sweep replaced
+    w, h = BULLET_SIZE
+    lengthX = abs(endX - startX)
+    lengthY = abs(endY - startY)
+    interpolation = []
+    iterations = max(lengthX / w, lengthY / h)
+    if startX < endX:
+        deltaX = lengthX / iterations
+    else:
+        deltaX = (lengthX / iterations) * -1
+    if startY < endY:
+        deltaY = lengthY / iterations
+    else:
+        deltaY = (lengthY / iterations) * -1
+    i = 0
+    x = startX
+    y = startY
+    while i <= iterations:
+        interpolation.append((int(x), int(y), w, h))
+        if (deltaX < 0 and x > endX) or (deltaX > 0 and x < endX):
+            x = x + deltaX
+        if (deltaY < 0 and y > endY) or (deltaY > 0 and y < endY):
+            y = y + deltaY
+        i = i + 1
+    return interpolation
+
+
+def createWorld(seed, shipCount, bulletCount, width=WORLD_SIZE[0],
+                height=WORLD_SIZE[1]):
+    rng = random.Random(seed)
+    ships = {}
+    for key in range(shipCount):
+        ship = ShipState(rng.randint(0, width - 41),
+                         rng.randint(0, height - 32))
+        ship.velocity = rng.uniform(0, 15)
+        ship.direction = rng.uniform(0, 360)
+        ships[key] = ship
+    bullets = BulletPool()
+    for i in range(bulletCount):
+        bullets.add(rng.randrange(shipCount), i, rng.randint(0, width),
+                    rng.randint(0, height), rng.uniform(0, 360), 0, 0.0)
+    return ships, bullets
+
+
+def copyShips(ships):
+    return {key: ship.copy() for key, ship in ships.items()}
+
+
+def shipStates(ships):
+    return {key: (ship.x, ship.y, ship.velocity, ship.direction,
+                  ship.hitpoints, ship.colliding)
+            for key, ship in ships.items()}
+
+
+def withGrid(ships, useGrid):
+    if not useGrid:
+        return None
+    grid = SpatialHash()
+    grid.rebuild(ships)
+    return grid
+
+
+def recordHistory(ships, when):
+    # ships drift back along a fixed heading per ship over the ring
+    history = PositionHistory()
+    for tick in range(HISTORY_TICKS - 1, -1, -1):
+        past = {}
+        for key, ship in ships.items():
+            ship = ship.copy()
+            ship.x = ship.x - tick * (key % 5 - 2) * 4
+            ship.y = ship.y - tick * (key % 3 - 1) * 4
+            past[key] = ship
+        history.record(when - tick * 0.05, past)
+    return history
+
+
+class SweepTest(unittest.TestCase):
+    def testPositionsMatchInterpolation(self):
+        rng = random.Random(0)
+        w, h = BULLET_SIZE
+        startX = np.array([rng.randint(0, 1900) for i in range(500)])
+        startY = np.array([rng.randint(0, 900) for i in range(500)])
+        radians = np.radians([rng.uniform(0, 360) for i in range(500)])
+        endX = startX + np.trunc(-np.sin(radians) * 60).astype(np.int64)
+        endY = startY + np.trunc(-np.cos(radians) * 60).astype(np.int64)
+        iterations = np.maximum(np.abs(endX - startX) / w,
+                                np.abs(endY - startY) / h)
+        steps = int(iterations.max()) + 1
+        x = sweepPositions(startX, endX, iterations, steps)
+        y = sweepPositions(startY, endY, iterations, steps)
+        for i in range(len(startX)):
+            valid = [j for j in range(steps) if j <= iterations[i]]
+            self.assertEqual(
+                [(int(x[i, j]), int(y[i, j]), w, h) for j in valid],
+                interpolate(int(startX[i]), int(startY[i]), int(endX[i]),
+                            int(endY[i])))
+
+    def testHitsMatchInterpolation(self):
+        for seed in range(5):
+            ships, bullets = createWorld(seed, 30, 300, 600, 400)
+            n = bullets.count
+            startX = bullets.x[:n].copy()
+            startY = bullets.y[:n].copy()
+            bullets.advance(0.0)
+            shipList = list(ships.values())
+            hits = bullets.sweep(
+                startX, startY, np.array([ship.x for ship in shipList]),
+                np.array([ship.y for ship in shipList]),
+                np.array([ship.w for ship in shipList]),
+                np.array([ship.h for ship in shipList]))
+            expected = np.zeros_like(hits)
+            for i in range(n):
+                rects = interpolate(int(startX[i]), int(startY[i]),
+                                    int(bullets.x[i]), int(bullets.y[i]))
+                for j, ship in enumerate(shipList):
+                    expected[i, j] = any(
+                        rectsCollide(ship.x, ship.y, ship.w, ship.h, *rect)
+                        for rect in rects)
+            self.assertTrue(expected.any())
+            self.assertTrue(np.array_equal(hits, expected))
+
+
+class BroadphaseTest(unittest.TestCase):
+    # the grid is only used in rooms of GRID_MIN_SHIPS and more, these keep
+    # it giving the same results as the all-pairs paths
+    def tearDown(self):
+        freezeTime(None)
+
+    def testMovements(self):
+        for seed in range(5):
+            ships, bullets = createWorld(seed, 60, 0, 900, 500)
+            rng = random.Random(seed)
+            inputs = {}
+            for key in ships:
+                inputs[key] = sorted(
+                    ({'seq': i, 'delta': 0.05, 'timestamp': rng.random(),
+                      'mask': rng.choice(MASKS)} for i in range(4)),
+                    key=lambda item: item['timestamp'])
+            results = []
+            for useGrid in (False, True):
+                freezeTime(100.0)
+                tickShips = copyShips(ships)
+                simulateMovements(tickShips, formTimeLineData(inputs),
+                                  withGrid(tickShips, useGrid))
+                results.append(shipStates(tickShips))
+            self.assertTrue(any(state[5] for state in results[0].values()))
+            self.assertEqual(results[0], results[1])
+
+    def checkBullets(self, lagged):
+        for seed in range(5):
+            ships, bullets = createWorld(seed, 40, 400, 900, 500)
+            rng = random.Random(seed)
+            when = 100.0
+            history = None
+            lags = None
+            n = bullets.count
+            bullets.time[:n] = when
+            if lagged:
+                history = recordHistory(ships, when)
+                lags = {key: rng.uniform(0, 0.2) for key in ships}
+                bullets.lag[:n] = [lags[owner] for owner in
+                                   bullets.owner[:n].tolist()]
+            results = []
+            for useGrid in (False, True, None):
+                freezeTime(when)
+                tickShips = copyShips(ships)
+                tickBullets = bullets.copy()
+                if useGrid is None:
+                    # the same tick without rewinding
+                    handleBullets(tickShips, tickBullets)
+                else:
+                    handleBullets(tickShips, tickBullets,
+                                  withGrid(tickShips, useGrid), history,
+                                  lags)
+                results.append((shipStates(tickShips),
+                                list(tickBullets.records())))
+            self.assertTrue(any(state[4] < 10
+                                for state in results[0][0].values()))
+            self.assertEqual(results[0], results[1])
+            self.assertEqual(results[0] != results[2], lagged)
+
+    def testBullets(self):
+        self.checkBullets(False)
+
+    def testLaggedBullets(self):
+        self.checkBullets(True)
+
+    def testBarriers(self):
+        ships, bullets = createWorld(0, 80, 0)
+        results = []
+        for useGrid in (False, True):
+            tickShips = copyShips(ships)
+            handleBarriers(tickShips, createBarriers(),
+                           withGrid(tickShips, useGrid))
+            results.append(shipStates(tickShips))
+        self.assertTrue(any(state[4] < 10 for state in results[0].values()))
+        self.assertEqual(results[0], results[1])
+
+
+class LagCompensationTest(unittest.TestCase):
+    def tearDown(self):
+        freezeTime(None)
+
+    def shootThroughPast(self, grid):
+        # the shooter came up from below and fires down through where it
+        # was 0.2 s ago, the target sits in the path at its old position
+        when = 100.0
+        shooter = ShipState(500, 500)
+        target = ShipState(800, 0)
+        ships = {0: shooter, 1: target}
+        history = PositionHistory()
+        history.record(when - 0.2, {0: ShipState(500, 590),
+                                    1: ShipState(505, 600)})
+        history.record(when, ships)
+        freezeTime(when)
+        shooter.gun.fired.append((0, 180, 520, 516))
+        if grid is not None:
+            grid.rebuild(ships)
+        handleBullets(ships, BulletPool(), grid, history, {0: 0.2})
+        return shooter, target
+
+    def testShooterIsNotRewound(self):
+        for grid in (None, SpatialHash()):
+            shooter, target = self.shootThroughPast(grid)
+            self.assertEqual(shooter.hitpoints, 10)
+            self.assertEqual(target.hitpoints, 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+import random
+import unittest
+
+from simulation import ShipState, BulletPool
+from snapshotCodec import SnapshotEncoder, SnapshotDecoder, encodeSnapshot
+from snapshotCodec import captureState, shipData, shipFields
+
+WORLD_SIZE = (1900, 900)
+
+
+def randomShip(rng):
+    ship = ShipState(rng.randint(0, WORLD_SIZE[0] - 41),
+                     rng.randint(0, WORLD_SIZE[1] - 32))
+    ship.velocity = rng.uniform(0, 15)
+    ship.direction = rng.uniform(0, 360)
+    return ship
+
+
+class World():
+    # a room that moves, adds and removes ships and bullets every tick
+    def __init__(self, seed, shipCount=8, bulletCount=30):
+        self.rng = random.Random(seed)
+        self.ships = {key: randomShip(self.rng) for key in range(shipCount)}
+        self.nextKey = shipCount
+        self.bullets = {}
+        self.nextBullet = 0
+        for i in range(bulletCount):
+            self.addBullet()
+
+    def addBullet(self):
+        owner = self.rng.choice(list(self.ships))
+        self.bullets[(owner, self.nextBullet)] = (
+            self.rng.randint(0, WORLD_SIZE[0]),
+            self.rng.randint(0, WORLD_SIZE[1]),
+            self.rng.uniform(0, 360), 0.0, self.rng.random())
+        self.nextBullet = self.nextBullet + 1
+
+    def step(self):
+        rng = self.rng
+        for key, ship in self.ships.items():
+            if rng.random() < 0.6:
+                ship.x = min(max(ship.x + rng.randint(-40, 40), 0),
+                             WORLD_SIZE[0] - 41)
+                ship.y = min(max(ship.y + rng.randint(-40, 40), 0),
+                             WORLD_SIZE[1] - 32)
+            if rng.random() < 0.3:
+                ship.direction = rng.uniform(0, 360)
+            if rng.random() < 0.1:
+                ship.hitpoints = ship.hitpoints - 1
+                ship.colliding = not ship.colliding
+        if len(self.ships) > 2 and rng.random() < 0.2:
+            key = rng.choice(list(self.ships)[1:])
+            del self.ships[key]
+            for bullet in [bullet for bullet in self.bullets
+                           if bullet[0] == key]:
+                del self.bullets[bullet]
+        if rng.random() < 0.2:
+            self.ships[self.nextKey] = randomShip(rng)
+            self.nextKey = self.nextKey + 1
+        for key, (x, y, direction, age, bulletTime) in list(
+                self.bullets.items()):
+            if rng.random() < 0.15:
+                del self.bullets[key]
+            else:
+                self.bullets[key] = (x + rng.randint(-20, 20), y,
+                                     direction, age + 0.05, bulletTime)
+        for i in range(rng.randint(0, 5)):
+            self.addBullet()
+
+    def bulletPool(self):
+        return BulletPool.fromRecords(
+            [key + values for key, values in self.bullets.items()])
+
+
+def expected(state, clientId, ship):
+    shipState, bulletState = state
+    ships = {key: shipData(values) for key, values in shipState.items()}
+    if clientId in ships:
+        ships[clientId] = shipData(shipFields(ship))
+    bullets = sorted(key + values for key, values in bulletState.items())
+    return ships, bullets
+
+
+class SnapshotCodecTest(unittest.TestCase):
+    def assertDecoded(self, decoded, state, clientId, ship):
+        ships, bullets = expected(state, clientId, ship)
+        self.assertEqual(decoded['ships'], ships)
+        self.assertEqual(sorted(decoded['bullets']), bullets)
+
+    def runTicks(self, seed, ticks, encoder, loss=0.0, ackDelay=0):
+        world = World(seed)
+        rng = random.Random(seed + 1)
+        decoders = {key: SnapshotDecoder() for key in world.ships}
+        acks = {key: [0] for key in world.ships}
+        decodedCount = 0
+        for tick in range(1, ticks + 1):
+            world.step()
+            encoder.capture(tick, tick * 0.05, world.ships,
+                            world.bulletPool())
+            for key, decoder in decoders.items():
+                if key not in world.ships:
+                    continue
+                ship = world.ships[key]
+                history = acks[key]
+                ack = history[max(len(history) - 1 - ackDelay, 0)]
+                data = bytes(encoder.encodeFor(key, ship, ack, tick * 2))
+                if rng.random() < loss:
+                    continue
+                decoded = decoder.decode(data)
+                if decoded is None:
+                    continue
+                decodedCount = decodedCount + 1
+                self.assertEqual(decoded['tick'], tick)
+                self.assertEqual(decoded['clientId'], key)
+                self.assertEqual(decoded['lastSeq'], tick * 2)
+                self.assertDecoded(decoded, encoder.view(
+                    tick, encoder.cellFor(ship)), key, ship)
+                history.append(tick)
+        return decodedCount
+
+    def testRoundTrip(self):
+        world = World(0)
+        encoder = SnapshotEncoder()
+        encoder.capture(1, 0.05, world.ships, world.bulletPool())
+        decoded = SnapshotDecoder().decode(
+            bytes(encoder.encodeFor(0, world.ships[0], 0, 7)))
+        self.assertEqual(decoded['handshake'], 0)
+        self.assertEqual(decoded['timeStamp'], 0.05)
+        self.assertEqual(decoded['lastSeq'], 7)
+        self.assertIsNone(decoded['summary'])
+        self.assertDecoded(decoded, encoder.state, 0, world.ships[0])
+
+    def testDeltasAgainstAcks(self):
+        for seed in range(5):
+            encoder = SnapshotEncoder()
+            self.assertGreater(self.runTicks(seed, 80, encoder), 0)
+
+    def testPacketLossAndStaleAcks(self):
+        for seed in range(5):
+            encoder = SnapshotEncoder(historySize=16)
+            self.assertGreater(
+                self.runTicks(seed, 120, encoder, loss=0.3, ackDelay=3), 0)
+
+    def testAckOlderThanHistory(self):
+        world = World(1)
+        encoder = SnapshotEncoder(historySize=4)
+        decoder = SnapshotDecoder()
+        encoder.capture(1, 0.05, world.ships, world.bulletPool())
+        decoder.decode(bytes(encoder.encodeFor(0, world.ships[0], 0)))
+        for tick in range(2, 10):
+            world.step()
+            encoder.capture(tick, tick * 0.05, world.ships,
+                            world.bulletPool())
+        data = bytes(encoder.encodeFor(0, world.ships[0], 1))
+        decoded = decoder.decode(data)
+        self.assertDecoded(decoded, encoder.state, 0, world.ships[0])
+
+    def testRemovals(self):
+        world = World(2)
+        encoder = SnapshotEncoder()
+        decoder = SnapshotDecoder()
+        encoder.capture(1, 0.05, world.ships, world.bulletPool())
+        decoder.decode(bytes(encoder.encodeFor(0, world.ships[0], 0)))
+        del world.ships[1]
+        removed = next(iter(world.bullets))
+        del world.bullets[removed]
+        encoder.capture(2, 0.1, world.ships, world.bulletPool())
+        decoded = decoder.decode(
+            bytes(encoder.encodeFor(0, world.ships[0], 1)))
+        self.assertNotIn(1, decoded['ships'])
+        self.assertNotIn(removed, [bullet[:2]
+                                   for bullet in decoded['bullets']])
+        self.assertDecoded(decoded, encoder.state, 0, world.ships[0])
+
+    def testStaleAndMissingBaseline(self):
+        world = World(3)
+        encoder = SnapshotEncoder()
+        decoder = SnapshotDecoder()
+        encoder.capture(1, 0.05, world.ships, world.bulletPool())
+        first = bytes(encoder.encodeFor(0, world.ships[0], 0))
+        world.step()
+        encoder.capture(2, 0.1, world.ships, world.bulletPool())
+        second = bytes(encoder.encodeFor(0, world.ships[0], 1))
+        # the baseline of the second snapshot never arrived
+        self.assertIsNone(decoder.decode(second))
+        world.step()
+        encoder.capture(3, 0.15, world.ships, world.bulletPool())
+        third = bytes(encoder.encodeFor(0, world.ships[0], 0))
+        self.assertIsNotNone(decoder.decode(third))
+        # reordered packets older than the last decoded tick are dropped
+        self.assertIsNone(decoder.decode(first))
+        self.assertEqual(decoder.lastTick, 3)
+
+    def testHandshake(self):
+        world = World(4)
+        bullets = world.bulletPool()
+        data = encodeSnapshot(world.ships, bullets, 0, 1.5, 3, 1)
+        decoder = SnapshotDecoder()
+        decoded = decoder.decode(data)
+        self.assertEqual(decoded['handshake'], 1)
+        self.assertEqual(decoded['clientId'], 3)
+        self.assertDecoded(decoded, captureState(world.ships, bullets), 3,
+                           world.ships[3])
+        # a handshake is no baseline and does not move the tick on
+        self.assertEqual(decoder.lastTick, 0)
+
+    def testCulling(self):
+        for seed in range(3):
+            encoder = SnapshotEncoder(interestRadius=300, summaryInterval=5,
+                                      worldSize=WORLD_SIZE)
+            self.assertGreater(
+                self.runTicks(seed, 60, encoder, loss=0.2, ackDelay=1), 0)
+
+    def testCullingCoveringTheWorldIsOff(self):
+        encoder = SnapshotEncoder(interestRadius=2048, worldSize=WORLD_SIZE)
+        self.assertIsNone(encoder.cellFor(randomShip(random.Random(0))))
+
+    def testSummary(self):
+        world = World(5, shipCount=2, bulletCount=0)
+        world.ships[0].x, world.ships[0].y = 0, 0
+        world.ships[1].x, world.ships[1].y = 1800, 800
+        encoder = SnapshotEncoder(interestRadius=300, summaryInterval=5,
+                                  worldSize=WORLD_SIZE)
+        decoder = SnapshotDecoder()
+        for tick in range(1, 6):
+            encoder.capture(tick, tick * 0.05, world.ships,
+                            world.bulletPool())
+            decoded = decoder.decode(
+                bytes(encoder.encodeFor(0, world.ships[0], tick - 1)))
+            self.assertEqual(list(decoded['ships']), [0])
+        self.assertEqual(decoded['summary'], [(1, 1800, 800)])
+
+    def testTruncatedSummary(self):
+        world = World(6, shipCount=2, bulletCount=0)
+        world.ships[1].x, world.ships[1].y = 1800, 800
+        world.ships[0].x, world.ships[0].y = 0, 0
+        encoder = SnapshotEncoder(interestRadius=300, summaryInterval=1,
+                                  worldSize=WORLD_SIZE)
+        encoder.capture(1, 0.05, world.ships, world.bulletPool())
+        data = bytes(encoder.encodeFor(0, world.ships[0], 0))
+        with self.assertRaises(ValueError):
+            SnapshotDecoder().decode(data[:-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
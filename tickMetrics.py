@@ -0,0 +1,214 @@
+import asyncio
+import bisect
+import json
+import time
+
+PREFIX = 'spaceshooter_'
+PHASES = ('copy', 'movements', 'capture', 'bullets', 'barriers', 'encode',
+          'send', 'cleanup')
+# why an input ring turned an input away
+DROP_REASONS = ('duplicates', 'stale', 'overflows')
+# tick duration buckets as fractions of the tick period
+BUCKETS = (0.25, 0.5, 0.75, 1, 1.25, 1.5, 2, 4)
+LOG_INTERVAL = 10
+
+
+class TickMetrics():
+    def __init__(self, period, clock=time.perf_counter):
+        self.clock = clock
+        self.period = period
+        self.buckets = [round(period * bucket, 6) for bucket in BUCKETS]
+        self.bucketCounts = [0] * (len(self.buckets) + 1)
+        self.durationSum = 0.0
+        self.ticks = 0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.mark = 0.0
+        self.packetsIn = 0
+        self.bytesIn = 0
+        self.packetsOut = 0
+        self.bytesOut = 0
+        self.rooms = {}
+        self.roomInputs = {}
+        self.logged = (time.time(), self.totals())
+
+    def start(self):
+        self.mark = self.clock()
+
+    def lap(self, phase):
+        now = self.clock()
+        self.phases[phase] = self.phases[phase] + now - self.mark
+        self.mark = now
+
+    def received(self, size):
+        self.packetsIn = self.packetsIn + 1
+        self.bytesIn = self.bytesIn + size
+
+    def sent(self, size):
+        self.packetsOut = self.packetsOut + 1
+        self.bytesOut = self.bytesOut + size
+
+    def entities(self, roomId, clients, ships, bullets):
+        self.rooms[roomId] = (clients, ships, bullets)
+
+    def inputs(self, roomId, stats):
+        self.roomInputs[roomId] = stats
+
+    def observeTick(self, duration):
+        self.ticks = self.ticks + 1
+        self.durationSum = self.durationSum + duration
+        index = bisect.bisect_left(self.buckets, duration)
+        self.bucketCounts[index] = self.bucketCounts[index] + 1
+
+    def inputTotal(self, name):
+        return sum(stats[name] for stats in self.roomInputs.values())
+
+    def totals(self):
+        return {'ticks': self.ticks,
+                'phases': dict(self.phases),
+                'packetsIn': self.packetsIn,
+                'bytesIn': self.bytesIn,
+                'packetsOut': self.packetsOut,
+                'bytesOut': self.bytesOut,
+                'inputsIn': self.inputTotal('received'),
+                'inputsDuplicate': self.inputTotal('duplicates'),
+                'inputsStale': self.inputTotal('stale'),
+                'inputsOverflow': self.inputTotal('overflows')}
+
+    def logRecord(self, scheduler):
+        # counters become per interval rates so every line stands alone
+        now = time.time()
+        totals = self.totals()
+        then, previous = self.logged
+        self.logged = (now, totals)
+        elapsed = max(now - then, 1e-9)
+        ticks = totals['ticks'] - previous['ticks']
+        phases = {}
+        for phase, seconds in totals['phases'].items():
+            spent = seconds - previous['phases'][phase]
+            phases[phase] = round(spent / max(ticks, 1) * 1000, 3)
+        record = {'event': 'tick_metrics',
+                  'time': round(now, 3),
+                  'ticks': ticks,
+                  'tickP50': round(scheduler.percentile(0.5) * 1000, 3),
+                  'tickP99': round(scheduler.percentile(0.99) * 1000, 3),
+                  'overruns': scheduler.overruns,
+                  'skipped': scheduler.skipped,
+                  'phaseMs': phases}
+        for name in ('packetsIn', 'bytesIn', 'packetsOut', 'bytesOut',
+                     'inputsIn', 'inputsDuplicate', 'inputsStale',
+                     'inputsOverflow'):
+            record[name + 'PerSecond'] = round(
+                (totals[name] - previous[name]) / elapsed, 1)
+        record['rooms'] = {str(roomId): {'clients': clients, 'ships': ships,
+                                         'bullets': bullets}
+                           for roomId, (clients, ships, bullets)
+                           in sorted(self.rooms.items())}
+        return record
+
+    def prometheus(self, scheduler):
+        lines = []
+
+        def metric(name, kind, helpText, samples):
+            lines.append('# HELP {}{} {}'.format(PREFIX, name, helpText))
+            lines.append('# TYPE {}{} {}'.format(PREFIX, name, kind))
+            for suffix, labels, value in samples:
+                labelText = ''
+                if labels:
+                    labelText = '{' + ','.join(
+                        '{}="{}"'.format(key, labelValue)
+                        for key, labelValue in labels) + '}'
+                lines.append('{}{}{}{} {}'.format(PREFIX, name, suffix,
+                                                  labelText, value))
+
+        metric('ticks_total', 'counter', 'Simulation ticks run.',
+               [('', (), self.ticks)])
+        metric('tick_phase_seconds_total', 'counter',
+               'Time spent in each phase of the room ticks.',
+               [('', (('phase', phase),), repr(seconds))
+                for phase, seconds in self.phases.items()])
+        buckets = []
+        count = 0
+        for bound, bucketCount in zip(self.buckets, self.bucketCounts):
+            count = count + bucketCount
+            buckets.append(('_bucket', (('le', repr(bound)),), count))
+        buckets.append(('_bucket', (('le', '+Inf'),), self.ticks))
+        buckets.append(('_sum', (), repr(self.durationSum)))
+        buckets.append(('_count', (), self.ticks))
+        metric('tick_duration_seconds', 'histogram',
+               'Wall time of a whole tick over every room.', buckets)
+        metric('tick_period_seconds', 'gauge', 'Target tick period.',
+               [('', (), repr(self.period))])
+        metric('tick_overruns_total', 'counter',
+               'Ticks that took longer than the period.',
+               [('', (), scheduler.overruns)])
+        metric('ticks_skipped_total', 'counter',
+               'Ticks dropped to catch up with the schedule.',
+               [('', (), scheduler.skipped)])
+        metric('tick_lateness_max_seconds', 'gauge',
+               'Latest a tick has started after its deadline.',
+               [('', (), repr(scheduler.maxLateness))])
+        metric('packets_received_total', 'counter',
+               'Datagrams received from clients.',
+               [('', (), self.packetsIn)])
+        metric('bytes_received_total', 'counter',
+               'Bytes received from clients.', [('', (), self.bytesIn)])
+        metric('packets_sent_total', 'counter',
+               'Snapshots sent to clients.', [('', (), self.packetsOut)])
+        metric('bytes_sent_total', 'counter',
+               'Snapshot bytes sent to clients.', [('', (), self.bytesOut)])
+        rooms = sorted(self.roomInputs.items())
+        metric('inputs_received_total', 'counter',
+               'Inputs received from clients.',
+               [('', (('room', roomId),), stats['received'])
+                for roomId, stats in rooms])
+        metric('inputs_dropped_total', 'counter',
+               'Inputs the input rings dropped, by reason.',
+               [('', (('room', roomId), ('reason', reason)), stats[reason])
+                for roomId, stats in rooms
+                for reason in DROP_REASONS])
+        for index, name in enumerate(('clients', 'ships', 'bullets')):
+            metric(name, 'gauge', 'Current {} per room.'.format(name),
+                   [('', (('room', roomId),), values[index])
+                    for roomId, values in sorted(self.rooms.items())])
+        return '\n'.join(lines) + '\n'
+
+
+async def serveMetrics(reader, writer, metrics, scheduler):
+    # just enough HTTP for a Prometheus scrape or curl
+    try:
+        request = await reader.readline()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+        parts = request.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1] in (
+                '/', '/metrics'):
+            status = '200 OK'
+            body = metrics.prometheus(scheduler).encode()
+        else:
+            status = '404 Not Found'
+            body = b'not found\n'
+        writer.write('HTTP/1.0 {}\r\nContent-Type: text/plain; '
+                     'version=0.0.4\r\nContent-Length: {}\r\n'
+                     'Connection: close\r\n\r\n'.format(
+                         status, len(body)).encode())
+        writer.write(body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def startMetricsServer(metrics, scheduler, ip, port):
+    return await asyncio.start_server(
+        lambda reader, writer: serveMetrics(reader, writer, metrics,
+                                            scheduler),
+        ip, port)
+
+
+async def logMetrics(metrics, scheduler, interval=LOG_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        print(json.dumps(metrics.logRecord(scheduler)), flush=True)
@@ -0,0 +1,78 @@
+import asyncio
+import math
+import time
+from collections import deque
+
+CATCH_UP = 'catchup'
+SKIP = 'skip'
+POLICIES = (CATCH_UP, SKIP)
+
+
+class TickScheduler():
+    def __init__(self, tickRate=20, policy=SKIP, maxCatchUp=3,
+                 historySize=200, clock=time.monotonic):
+        if policy not in POLICIES:
+            raise ValueError('unknown overrun policy: {}'.format(policy))
+        self.tickRate = tickRate
+        self.period = 1 / tickRate
+        self.policy = policy
+        self.maxCatchUp = maxCatchUp
+        self.clock = clock
+        self.deadline = None
+        self.tickStart = 0
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.lastDuration = 0
+        self.lastLateness = 0
+        self.maxLateness = 0
+        self.durations = deque(maxlen=historySize)
+
+    def beginTick(self):
+        now = self.clock()
+        if self.deadline is None:
+            self.deadline = now
+        self.lastLateness = now - self.deadline
+        if self.lastLateness > self.maxLateness:
+            self.maxLateness = self.lastLateness
+        self.tickStart = now
+        self.ticks = self.ticks + 1
+
+    def endTick(self):
+        now = self.clock()
+        self.lastDuration = now - self.tickStart
+        self.durations.append(self.lastDuration)
+        if self.lastDuration > self.period:
+            self.overruns = self.overruns + 1
+        self.deadline = self.deadline + self.period
+        behind = now - self.deadline
+        if behind <= 0:
+            return self.deadline - now
+        missed = math.ceil(behind / self.period)
+        if self.policy == SKIP or missed > self.maxCatchUp:
+            self.skipped = self.skipped + missed
+            self.deadline = self.deadline + missed * self.period
+            return self.deadline - now
+        return 0
+
+    async def waitNextTick(self):
+        # always yield so queued datagrams are handled between ticks
+        await asyncio.sleep(self.endTick())
+
+    def percentile(self, fraction):
+        if len(self.durations) == 0:
+            return 0
+        ordered = sorted(self.durations)
+        index = min(int(fraction * len(ordered)), len(ordered) - 1)
+        return ordered[index]
+
+    def stats(self):
+        return {'tickRate': self.tickRate,
+                'ticks': self.ticks,
+                'overruns': self.overruns,
+                'skipped': self.skipped,
+                'lastDuration': self.lastDuration,
+                'lastLateness': self.lastLateness,
+                'maxLateness': self.maxLateness,
+                'p50': self.percentile(0.5),
+                'p99': self.percentile(0.99)}